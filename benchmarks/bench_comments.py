@@ -0,0 +1,57 @@
+# compares scan_comments with the get_rst_comments + remove_comments pipeline
+# run from the directory containing svprettyplot:
+#   python -m svprettyplot.benchmarks.bench_comments [size_in_MB]
+
+import sys
+import timeit
+import svprettyplot.prettyplot as prettyplot
+
+MODULE_TEMPLATE = """/**
+ * The **mod%(i)d** module.
+ *
+ * .. tabularcolumns:: |l|l|J|
+ */
+module mod%(i)d #(
+  parameter int unsigned WIDTH = 32 // data width
+)
+(
+  input  logic             clk_i, //* clock
+  input  logic             rst_ni, /* active low */
+  input  logic [WIDTH-1:0] data_i,
+  output logic [WIDTH-1:0] data_o
+);
+%(body)s
+endmodule // mod%(i)d
+"""
+
+BODY_LINE = "  assign data_o = data_i; // pass-through /* not a block */\n"
+
+def generate(size):
+    modules = []
+    total = 0
+    i = 0
+    while total < size:
+        s = MODULE_TEMPLATE % dict(i=i, body=BODY_LINE*200)
+        modules.append(s)
+        total += len(s)
+        i += 1
+    return ''.join(modules)
+
+def legacy(code):
+    return prettyplot.get_rst_comments(code), prettyplot.remove_comments(code)
+
+def main(argv):
+    size_mb = float(argv[1]) if len(argv) > 1 else 8
+    code = generate(int(size_mb * 1024 * 1024))
+    comments, clean_code, _ = prettyplot.scan_comments(code)
+    if (comments, clean_code) != legacy(code):
+        print("WARNING: scan_comments and the legacy pipeline disagree")
+    t_legacy = min(timeit.repeat(lambda: legacy(code), number=1, repeat=5))
+    t_scan   = min(timeit.repeat(lambda: prettyplot.scan_comments(code), number=1, repeat=5))
+    print("input:                             %.1f MB" % (len(code) / 1024 / 1024))
+    print("get_rst_comments+remove_comments:  %.3f s (%.1f MB/s)" % (t_legacy, len(code) / t_legacy / 1024 / 1024))
+    print("scan_comments:                     %.3f s (%.1f MB/s)" % (t_scan, len(code) / t_scan / 1024 / 1024))
+    print("speedup:                           %.2fx" % (t_legacy / t_scan))
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,42 @@
+# import time of prettyplot with and without pydotplus, and DOT emission
+# time of the streaming writer against the pydotplus graph
+# run from the directory containing svprettyplot:
+#   python -m svprettyplot.benchmarks.bench_dot [nb_ports]
+
+import os
+import sys
+import time
+import timeit
+import subprocess
+import svprettyplot.prettyplot as prettyplot
+from svprettyplot.benchmarks.bench_layout import generate
+
+def import_time(statement, repeat=5):
+    # best wall time of a fresh interpreter running statement
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(prettyplot.__file__)))
+    best = float('inf')
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run([ sys.executable, '-c', statement ], cwd=cwd, check=True)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def main(argv):
+    nb_ports = int(argv[1]) if len(argv) > 1 else 10000
+    t_python = import_time('pass')
+    print("import prettyplot:             %8.1f ms" % ((import_time('import svprettyplot.prettyplot') - t_python) * 1000))
+    print("import prettyplot + pydotplus: %8.1f ms" % ((import_time('import svprettyplot.prettyplot, pydotplus') - t_python) * 1000))
+
+    module = generate(nb_ports)
+    dot = prettyplot.module_dot(module)
+    if dot != prettyplot.module_graph(module).to_string():
+        print("WARNING: write_dot and pydotplus disagree")
+    t_stream = min(timeit.repeat(lambda: prettyplot.module_dot(module), number=1, repeat=5))
+    t_graph  = min(timeit.repeat(lambda: prettyplot.module_graph(module).to_string(), number=1, repeat=3))
+    print("ports:                         %8d (%.1f kB of DOT)" % (nb_ports, len(dot) / 1024))
+    print("write_dot:                     %8.1f ms" % (t_stream * 1000))
+    print("pydotplus graph + to_string:   %8.1f ms" % (t_graph * 1000))
+    print("speedup:                       %8.1fx" % (t_graph / t_stream))
+
+if __name__ == "__main__":
+    main(sys.argv)
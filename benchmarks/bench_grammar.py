@@ -0,0 +1,113 @@
+# adversarial and fuzzed headers: time per byte of the header grammar, which
+# must stay flat as the input grows, against the backtracking grammar it
+# replaced (run in a child process, given up after LEGACY_TIMEOUT seconds)
+# run from the directory containing svprettyplot:
+#   python -m svprettyplot.benchmarks.bench_grammar [nb_fuzz]
+
+import sys
+import time
+import random
+import multiprocessing
+from collections import OrderedDict
+import svprettyplot.prettyplot as prettyplot
+
+LEGACY_RANGE = r'(\[\s*[\w\-\+\*\/\%\$\(\)]+\s*\:\s*[\w\-\+\*\/\%\$\(\)]+\s*\])?'
+
+LEGACY_TOKENS = OrderedDict(prettyplot.TOKENS, **{
+    'MODULE_KEYWORD' : r'.*module\s*',
+    'PORT_DECL'      : r'\A(input|output|inout)?\s*(\w+)?\s*(signed|unsigned)?\s*' + (LEGACY_RANGE + r'\s*')*4 + r'(\w+)\s*' + LEGACY_RANGE + r'\s*',
+})
+
+LEGACY_MATCHES = OrderedDict(prettyplot.MATCHES, PORT_DECL=( 'direction', 'type', 'sign', 'packed0', 'packed1', 'packed2', 'packed3', 'name', 'unpacked', ))
+
+# name -> function of n building an input of about n bytes
+CASES = OrderedDict([
+    # one long line without the module keyword: .*module was quadratic
+    ( 'no module keyword',   lambda n: 'x' * n ),
+    # the keyword hidden in strings, and many near misses
+    ( 'module in strings',   lambda n: '`include "module.svh" modul endmodule_ ' * (n // 40) + 'module m (input a);' ),
+    # whitespace between a direction and a missing name: the adjacent \s*
+    # of the optional groups were polynomial
+    ( 'port without name',   lambda n: 'module m (input' + ' ' * n + ',);' ),
+    # many packed ranges in front of a missing name
+    ( 'packed ranges',       lambda n: 'module m (input logic ' + '[7:0] ' * (n // 6) + ');' ),
+    # long parameter value that never ends the list
+    ( 'parameter value',     lambda n: 'module m #(parameter P = ' + 'a+' * (n // 2) + ' (' ),
+])
+
+SIZES = (16, 64, 256, 1024, 4096, 16384, 65536)
+LEGACY_TIMEOUT = 5
+
+def parse_time(code, tokens_list=prettyplot.TOKENS, matches_list=prettyplot.MATCHES):
+    t0 = time.perf_counter()
+    try:
+        prettyplot.tokenize_and_parse(code, tokens_list=tokens_list, matches_list=matches_list)
+    except prettyplot.ParseError:
+        pass
+    return time.perf_counter() - t0
+
+def legacy_worker(code, queue):
+    # compile outside of the measure
+    prettyplot.compile_tokens(LEGACY_TOKENS)
+    queue.put(parse_time(code, LEGACY_TOKENS, LEGACY_MATCHES))
+
+def legacy_time(code):
+    # None when the legacy grammar takes longer than LEGACY_TIMEOUT
+    queue = multiprocessing.Queue()
+    p = multiprocessing.Process(target=legacy_worker, args=(code, queue))
+    p.start()
+    p.join(LEGACY_TIMEOUT)
+    if p.is_alive():
+        p.terminate()
+        p.join()
+        return None
+    return queue.get()
+
+def mutate(code, rnd, nb_edits):
+    # random insertions, deletions and duplications of header characters
+    alphabet = ' \n\t()[]:;,.#=$*+-/%"`abcmodulenpt01'
+    code = list(code)
+    for i in range(nb_edits):
+        pos = rnd.randrange(len(code)+1)
+        op = rnd.randrange(3)
+        if op == 0:
+            code.insert(pos, rnd.choice(alphabet) * rnd.choice((1, 1, 2, 64)))
+        elif op == 1 and pos < len(code):
+            del code[pos]
+        elif pos < len(code):
+            code.insert(pos, ''.join(code[pos:pos+rnd.randrange(1, 32)]) * rnd.randrange(1, 16))
+    return ''.join(code)
+
+def main(argv):
+    nb_fuzz = int(argv[1]) if len(argv) > 1 else 2000
+    print("%-20s %8s %14s %14s" % ('case', 'bytes', 'legacy ns/B', 'current ns/B'))
+    for name, build in CASES.items():
+        legacy = True
+        for n in SIZES:
+            code = build(n)
+            t = min(parse_time(code) for i in range(3))
+            if not legacy:
+                legacy_s = '-'
+            else:
+                t_legacy = legacy_time(code)
+                legacy = t_legacy is not None
+                legacy_s = 'timeout' if t_legacy is None else '%.1f' % (t_legacy / len(code) * 1e9)
+            print("%-20s %8d %14s %14.1f" % (name, len(code), legacy_s, t / len(code) * 1e9))
+
+    # fuzzing: the worst time per byte over many mutated headers
+    from svprettyplot.benchmarks.suite import generate
+    rnd = random.Random(0)
+    seed = prettyplot.scan_comments(generate('fuzz', 4, 32, 2, 1, 8, 0))[1]
+    worst = 0.0
+    total_bytes = 0
+    total_time = 0.0
+    for i in range(nb_fuzz):
+        code = mutate(seed, rnd, rnd.randrange(1, 16))
+        t = parse_time(code)
+        worst = max(worst, t / len(code))
+        total_bytes += len(code)
+        total_time += t
+    print("fuzz: %d headers, %.1f ns/B on average, %.1f ns/B at worst" % (nb_fuzz, total_time / total_bytes * 1e9, worst * 1e9))
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,55 @@
+# DOT emission time and .dot size of the module block layouts, from 10 to
+# 1000 ports; the n_in*n_out grid that always_coprime=False used to emit is
+# rebuilt here for comparison
+# run from the directory containing svprettyplot:
+#   python -m svprettyplot.benchmarks.bench_layout [--graphviz]
+
+import os
+import sys
+import time
+import timeit
+import tempfile
+import svprettyplot.prettyplot as prettyplot
+from svprettyplot.prettyplot import ModuleHeader, Port
+
+PORT_COUNTS = (10, 30, 100, 300, 1000)
+
+def generate(nb_ports):
+    # 3 inputs for every 2 outputs, so that the counts are rarely coprime
+    nb_in = nb_ports * 3 // 5
+    inputs  = [ Port('in%d' % i, 'input', 'logic', '', ('[7:0]', ), '') for i in range(nb_in) ]
+    outputs = [ Port('out%d' % i, 'output', 'logic', '', ('[7:0]', ), '') for i in range(nb_ports - nb_in) ]
+    return ModuleHeader('bench', [], inputs, outputs, [], [], [], [])
+
+def grid_size(module):
+    # size of the block label with one row per (input, output) pair
+    n_in, n_out = len(module.input_ports), len(module.output_ports)
+    s = []
+    for i in range(n_in*n_out):
+        s.append('<TR>\n')
+        if i % n_out == 0:
+            s.append('<TD ROWSPAN="%d" PORT="i%d"><FONT COLOR="white">%s</FONT></TD>\n' % (n_out, i // n_out, module.input_ports[i // n_out].name))
+        if i % n_in == 0:
+            s.append('<TD ROWSPAN="%d" PORT="o%d"><FONT COLOR="white">%s</FONT></TD>\n' % (n_in, i // n_in, module.output_ports[i // n_in].name))
+        s.append('</TR>\n')
+    return len(''.join(s)) + len(prettyplot.module_dot(module, always_coprime=True))
+
+def main(argv):
+    graphviz = '--graphviz' in argv
+    print("%6s %10s %12s %12s %12s %12s" % ('ports', 'layout', 'emit (ms)', 'dot (kB)', 'grid (kB)', 'dot (ms)'))
+    for nb_ports in PORT_COUNTS:
+        module = generate(nb_ports)
+        for layout, always_coprime in (('stacked', True), ('spread', False)):
+            t = min(timeit.repeat(lambda: prettyplot.module_dot(module, always_coprime=always_coprime), number=1, repeat=5))
+            dot = prettyplot.module_dot(module, always_coprime=always_coprime)
+            t_dot = float('nan')
+            if graphviz:
+                with tempfile.TemporaryDirectory() as out_dir:
+                    t0 = time.perf_counter()
+                    prettyplot.render_dot(dot, os.path.join(out_dir, 'bench'), ('svg', ))
+                    t_dot = time.perf_counter() - t0
+            grid = grid_size(module) if layout == 'spread' else len(dot)
+            print("%6d %10s %12.2f %12.1f %12.1f %12.1f" % (nb_ports, layout, t*1000, len(dot)/1024, grid/1024, t_dot*1000))
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,50 @@
+# compares the typed module header model with its legacy dict view
+# run from the directory containing svprettyplot:
+#   python -m svprettyplot.benchmarks.bench_model [nb_modules]
+
+import sys
+import timeit
+import tracemalloc
+import svprettyplot.prettyplot as prettyplot
+
+def generate(i, nb_ports=24):
+    ports = []
+    for j in range(nb_ports):
+        if j % 6 == 5:
+            ports.append("  hwpe_stream_intf_stream.%s s%d_%d [1:0]" % ('sink' if j % 2 else 'source', i, j))
+        else:
+            ports.append("  %s logic [%d:0][7:0] p%d_%d" % ('input' if j % 2 else 'output', j, i, j))
+    return "module mod%d #(\n  parameter int unsigned WIDTH = 32,\n  parameter DEPTH = 8\n) (\n%s\n);\nendmodule\n" % (i, ",\n".join(ports))
+
+def measure(build):
+    tracemalloc.start()
+    modules = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return modules, size
+
+def labels_typed(modules):
+    return [ p.unpacked+''.join(p.packed) for m in modules for p in m.input_ports ]
+
+def labels_dict(modules):
+    return [ p['unpacked']+p['packed0']+p['packed1']+p['packed2']+p['packed3'] for m in modules for p in m['input_ports'] ]
+
+def main(argv):
+    nb_modules = int(argv[1]) if len(argv) > 1 else 3000
+    tokens = [ prettyplot.tokenize_systemverilog(generate(i))[0] for i in range(nb_modules) ]
+
+    typed, typed_size = measure(lambda: [ prettyplot.interpret_systemverilog(t) for t in tokens ])
+    dicts, dict_size = measure(lambda: [ m.as_dict() for m in typed ])
+    t_interpret = min(timeit.repeat(lambda: [ prettyplot.interpret_systemverilog(t) for t in tokens ], number=1, repeat=5))
+    t_typed = min(timeit.repeat(lambda: labels_typed(typed), number=1, repeat=5))
+    t_dict  = min(timeit.repeat(lambda: labels_dict(dicts), number=1, repeat=5))
+
+    print("modules:                       %d" % nb_modules)
+    print("interpret_systemverilog:       %.3f s (%.0f modules/s)" % (t_interpret, nb_modules / t_interpret))
+    print("memory, ModuleHeader:          %.1f MB" % (typed_size / 1024 / 1024))
+    print("memory, dict view:             %.1f MB" % (dict_size / 1024 / 1024))
+    print("edge labels, ModuleHeader:     %.3f s" % t_typed)
+    print("edge labels, dict view:        %.3f s" % t_dict)
+
+if __name__ == "__main__":
+    main(sys.argv)
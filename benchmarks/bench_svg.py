@@ -0,0 +1,31 @@
+# diagrams per second of the native SVG backend vs Graphviz
+# run from the directory containing svprettyplot:
+#   python -m svprettyplot.benchmarks.bench_svg [nb_diagrams]
+
+import os
+import sys
+import time
+import tempfile
+import svprettyplot.prettyplot as prettyplot
+from svprettyplot.benchmarks.bench_model import generate
+
+def throughput(modules, backend, out_dir):
+    t0 = time.perf_counter()
+    for i, module in enumerate(modules):
+        prettyplot.render_module(module, os.path.join(out_dir, 'm%d' % i), formats=('svg', ), backend=backend)
+    return len(modules) / (time.perf_counter() - t0)
+
+def main(argv):
+    nb_diagrams = int(argv[1]) if len(argv) > 1 else 200
+    modules = [ prettyplot.interpret_systemverilog(prettyplot.tokenize_systemverilog(generate(i))[0]) for i in range(nb_diagrams) ]
+    with tempfile.TemporaryDirectory() as out_dir:
+        print("native:   %8.1f diagrams/s" % throughput(modules, 'native', out_dir))
+        try:
+            prettyplot.find_dot()
+        except prettyplot.GraphvizError as e:
+            print("graphviz: skipped (%s)" % e)
+            return
+        print("graphviz: %8.1f diagrams/s" % throughput(modules, 'graphviz', out_dir))
+
+if __name__ == "__main__":
+    main(sys.argv)
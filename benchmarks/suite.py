@@ -0,0 +1,133 @@
+# per-stage benchmark suite on synthetic module headers
+# run from the directory containing svprettyplot:
+#   python -m svprettyplot.benchmarks.suite [-o results.json] [--compare baseline.json]
+# with --compare, the stages slower than the baseline by more than the
+# threshold are listed and the exit status is 1
+
+import os
+import sys
+import json
+import timeit
+import platform
+import tempfile
+import argparse
+from collections import OrderedDict
+import svprettyplot.prettyplot as prettyplot
+
+# name -> (parameters, ports, packed dims, unpacked dims, interfaces, comments)
+CASES = OrderedDict([
+    ( 'small',      (  2,   8, 1, 0,   2,   2 ) ),
+    ( 'medium',     ( 10,  64, 2, 1,  16,  16 ) ),
+    ( 'large',      ( 40, 512, 4, 1,  64, 128 ) ),
+    ( 'comments',   (  2,  64, 1, 0,   0, 512 ) ),
+])
+
+COMMENT = """/**
+ * Block comment %d of the synthetic module, rendered as RST.
+ *
+ * .. note:: %s
+ */
+"""
+
+def generate(name='synth', nb_params=2, nb_ports=8, nb_packed=1, nb_unpacked=0, nb_interfaces=2, nb_comments=2):
+    # synthetic module header; the ports alternate between inputs and outputs
+    # and the interfaces between incoming and outgoing HWPE streams
+    s = [ COMMENT % (i, 'x'*40) for i in range(nb_comments) ]
+    s.append("module %s\n" % name)
+    if nb_params > 0:
+        s.append("#(\n%s\n)\n" % ",\n".join("  parameter int unsigned P%d = %d" % (i, 8+i) for i in range(nb_params)))
+    packed = ''.join('[P%d-1:0]' % (j % max(nb_params, 1)) if nb_params > 0 else '[7:0]' for j in range(nb_packed))
+    unpacked = ' [3:0]' * nb_unpacked
+    ports = []
+    for i in range(nb_ports):
+        ports.append("  %s logic %s p%d%s" % ('input' if i % 2 == 0 else 'output', packed, i, unpacked))
+    for i in range(nb_interfaces):
+        ports.append("  hwpe_stream_intf_stream.%s s%d%s" % ('sink' if i % 2 == 0 else 'source', i, unpacked))
+    s.append("(\n%s\n);\nendmodule\n" % ",\n".join(ports))
+    return ''.join(s)
+
+def best(f, repeat):
+    return min(timeit.repeat(f, number=1, repeat=repeat))
+
+def run_case(code, repeat, graphviz):
+    comments = prettyplot.get_rst_comments(code)
+    clean_code = prettyplot.remove_comments(code)
+    tokens = prettyplot.tokenize_and_parse(clean_code)
+    module = prettyplot.interpret_systemverilog(tokens)
+    dot = prettyplot.module_dot(module)
+    times = OrderedDict()
+    times['get_rst_comments'] = best(lambda: prettyplot.get_rst_comments(code), repeat)
+    times['remove_comments'] = best(lambda: prettyplot.remove_comments(code), repeat)
+    times['scan_comments'] = best(lambda: prettyplot.scan_comments(code), repeat)
+    times['tokenize_and_parse'] = best(lambda: prettyplot.tokenize_and_parse(clean_code), repeat)
+    times['interpret_systemverilog'] = best(lambda: prettyplot.interpret_systemverilog(tokens), repeat)
+    times['dot_emission'] = best(lambda: prettyplot.module_dot(module), repeat)
+    if graphviz:
+        with tempfile.TemporaryDirectory() as out_dir:
+            genimg_path = os.path.join(out_dir, 'bench')
+            times['graphviz'] = best(lambda: prettyplot.render_dot(dot, genimg_path, ('svg', )), max(repeat // 5, 1))
+    info = OrderedDict([ ('bytes', len(code)), ('tokens', len(tokens)), ('comments', len(comments[0])+len(comments[1])), ('dot_bytes', len(dot)) ])
+    return info, times
+
+def compare(results, baseline, threshold):
+    # list of (case, stage, baseline, current) for the stages slower than
+    # the baseline by more than threshold
+    regressions = []
+    for case, result in results['cases'].items():
+        base = baseline['cases'].get(case)
+        if base is None or base['config'] != result['config']:
+            continue
+        for stage, t in result['times'].items():
+            t_base = base['times'].get(stage)
+            if t_base is not None and t > t_base * (1+threshold):
+                regressions.append((case, stage, t_base, t))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time each stage of sv_prettyplot on synthetic module headers.")
+    parser.add_argument('-o', '--output', default=None, help="write the results to this JSON file")
+    parser.add_argument('--compare', default=None, metavar='BASELINE', help="flag the regressions against a saved JSON result")
+    parser.add_argument('--threshold', type=float, default=0.2, help="relative slowdown reported as a regression (default: 0.2)")
+    parser.add_argument('--repeat', type=int, default=10, help="runs per stage, the best one is kept")
+    parser.add_argument('--case', action='append', default=None, choices=list(CASES), help="run only these cases")
+    parser.add_argument('--custom', default=None, metavar='P,N,K,U,I,C', help="add a case with P parameters, N ports, K packed and U unpacked dims, I interfaces and C comments")
+    parser.add_argument('--no-graphviz', action='store_true', help="skip the Graphviz rendering stage")
+    args = parser.parse_args(argv)
+
+    cases = OrderedDict((name, CASES[name]) for name in (args.case or CASES))
+    if args.custom is not None:
+        cases['custom'] = tuple(int(n) for n in args.custom.split(','))
+
+    graphviz = not args.no_graphviz
+    if graphviz:
+        try:
+            prettyplot.find_dot()
+        except prettyplot.GraphvizError as e:
+            print("graphviz: skipped (%s)" % e, file=sys.stderr)
+            graphviz = False
+
+    results = OrderedDict([ ('python', platform.python_version()), ('platform', platform.platform()), ('cases', OrderedDict()) ])
+    print("%-10s %-24s %12s" % ('case', 'stage', 'time (ms)'))
+    for name, config in cases.items():
+        info, times = run_case(generate(name, *config), args.repeat, graphviz)
+        results['cases'][name] = OrderedDict([ ('config', list(config)), ('info', info), ('times', times) ])
+        for stage, t in times.items():
+            print("%-10s %-24s %12.3f" % (name, stage, t*1000))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for case, stage, t_base, t in regressions:
+            print("REGRESSION %s %s: %.3f ms -> %.3f ms (%+.0f%%)" % (case, stage, t_base*1000, t*1000, (t/t_base-1)*100))
+        if len(regressions) > 0:
+            return 1
+        print("no regression above %.0f%%" % (args.threshold*100))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
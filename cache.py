@@ -0,0 +1,157 @@
+# content-addressed on-disk cache of rendered module diagrams
+
+import os
+import time
+import json
+import shutil
+import hashlib
+import tempfile
+
+# bump whenever the rendered output changes for the same source/options
+CACHE_VERSION = 3
+
+COMMENTS_FILE = 'comments.json'
+
+# a cache over max_size is evicted down to this fraction of it, so that the
+# following stores do not all scan it again
+EVICT_TARGET = 0.9
+
+class RenderCache(object):
+
+    def __init__(self, path, max_size=None, max_age=None):
+        # max_size in bytes, max_age in seconds; None disables that policy
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.path, exist_ok=True)
+        # total size of the entries and mtime of the oldest one, from a
+        # single scan kept up to date by store, so that the cache is only
+        # scanned again when a limit is exceeded; entries stored by other
+        # processes are seen at the next scan
+        self.size = 0
+        self.oldest = None
+        if max_size is not None or max_age is not None:
+            self.rescan()
+
+    def key(self, code, **options):
+        h = hashlib.sha256()
+        h.update(('%d\n' % CACHE_VERSION).encode())
+        h.update(repr(sorted(options.items())).encode())
+        h.update(b'\n')
+        h.update(code.encode() if isinstance(code, str) else code)
+        return h.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def fetch(self, key, genimg_path, suffixes):
+        # on a hit, link (or copy) the cached artifacts to genimg_path+suffix
+        # and return the cached comments; on a miss return None
+        entry = self.entry_path(key)
+        try:
+            with open(os.path.join(entry, COMMENTS_FILE), 'r') as f:
+                comments = json.load(f)
+            for suffix in suffixes:
+                place_file(os.path.join(entry, 'img'+suffix), genimg_path+suffix)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        # refresh the entry for the age/LRU policy
+        os.utime(entry)
+        self.hits += 1
+        return tuple(comments)
+
+    def store(self, key, genimg_path, suffixes, comments):
+        entry = self.entry_path(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(entry))
+        try:
+            for suffix in suffixes:
+                shutil.copyfile(genimg_path+suffix, os.path.join(tmp, 'img'+suffix))
+            with open(os.path.join(tmp, COMMENTS_FILE), 'w') as f:
+                json.dump(comments, f)
+            size = sum(os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp))
+            try:
+                os.rename(tmp, entry)
+                self.size += size
+                if self.oldest is None:
+                    self.oldest = os.path.getmtime(entry)
+            except OSError:
+                # somebody else stored the same entry concurrently
+                shutil.rmtree(tmp, ignore_errors=True)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        self.evict()
+
+    def entries(self):
+        # list of (mtime, size, path) for all cache entries
+        entries = []
+        for prefix in os.listdir(self.path):
+            prefix_path = os.path.join(self.path, prefix)
+            if not os.path.isdir(prefix_path):
+                continue
+            for key in os.listdir(prefix_path):
+                entry = os.path.join(prefix_path, key)
+                try:
+                    size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+                    entries.append((os.path.getmtime(entry), size, entry))
+                except OSError:
+                    pass
+        return entries
+
+    def rescan(self, entries=None):
+        entries = self.entries() if entries is None else entries
+        self.size = sum(e[1] for e in entries)
+        self.oldest = min(e[0] for e in entries) if len(entries) > 0 else None
+
+    def evict(self):
+        deadline = time.time() - self.max_age if self.max_age is not None else None
+        too_big = self.max_size is not None and self.size > self.max_size
+        too_old = deadline is not None and self.oldest is not None and self.oldest < deadline
+        if not (too_big or too_old):
+            return
+        entries = sorted(self.entries())
+        if deadline is not None:
+            while len(entries) > 0 and entries[0][0] < deadline:
+                shutil.rmtree(entries.pop(0)[2], ignore_errors=True)
+        if self.max_size is not None:
+            total = sum(e[1] for e in entries)
+            while len(entries) > 0 and total > self.max_size*EVICT_TARGET:
+                _, size, entry = entries.pop(0)
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+        self.rescan(entries)
+
+    def clear(self):
+        for entry in self.entries():
+            shutil.rmtree(entry[2], ignore_errors=True)
+        self.size = 0
+        self.oldest = None
+
+    def merge(self, hits, misses):
+        # add the counts of a copy of this cache (e.g. in a worker process)
+        self.hits += hits
+        self.misses += misses
+
+    def stats(self):
+        entries = self.entries()
+        return {
+            'hits'    : self.hits,
+            'misses'  : self.misses,
+            'entries' : len(entries),
+            'size'    : sum(e[1] for e in entries),
+        }
+
+def place_file(src, dst):
+    # hard-link when possible, fall back to a plain copy
+    try:
+        os.remove(dst)
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
@@ -0,0 +1,187 @@
+# persistent SQLite index of the module headers in an RTL tree
+
+import os
+import sys
+import json
+import sqlite3
+import hashlib
+import svprettyplot.prettyplot as prettyplot
+from svprettyplot.prettyplot import ModuleHeader, Parameter, Port, InterfacePort
+
+# bump whenever the schema or the parser output changes
+INDEX_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path     TEXT PRIMARY KEY,
+    mtime    REAL,
+    size     INTEGER,
+    hash     TEXT
+);
+CREATE TABLE IF NOT EXISTS modules (
+    name     TEXT,
+    path     TEXT REFERENCES files(path) ON DELETE CASCADE,
+    header   TEXT,
+    comments TEXT
+);
+CREATE TABLE IF NOT EXISTS parameters (
+    module   TEXT,
+    path     TEXT REFERENCES files(path) ON DELETE CASCADE,
+    name     TEXT,
+    value    TEXT
+);
+CREATE TABLE IF NOT EXISTS ports (
+    module   TEXT,
+    path     TEXT REFERENCES files(path) ON DELETE CASCADE,
+    name     TEXT,
+    direction TEXT,
+    type     TEXT
+);
+CREATE TABLE IF NOT EXISTS interfaces (
+    module   TEXT,
+    path     TEXT REFERENCES files(path) ON DELETE CASCADE,
+    name     TEXT,
+    interface TEXT,
+    modport  TEXT,
+    direction TEXT
+);
+CREATE INDEX IF NOT EXISTS modules_name ON modules(name);
+CREATE INDEX IF NOT EXISTS modules_path ON modules(path);
+CREATE INDEX IF NOT EXISTS parameters_name ON parameters(name);
+CREATE INDEX IF NOT EXISTS parameters_path ON parameters(path);
+CREATE INDEX IF NOT EXISTS ports_path ON ports(path);
+CREATE INDEX IF NOT EXISTS interfaces_interface ON interfaces(interface);
+CREATE INDEX IF NOT EXISTS interfaces_path ON interfaces(path);
+"""
+
+def header_from_json(s):
+    h = json.loads(s)
+    return ModuleHeader(
+        h[0],
+        [ Parameter(*p) for p in h[1] ],
+        [ Port(p[0], p[1], p[2], p[3], tuple(p[4]), p[5]) for p in h[2] ],
+        [ Port(p[0], p[1], p[2], p[3], tuple(p[4]), p[5]) for p in h[3] ],
+        [ Port(p[0], p[1], p[2], p[3], tuple(p[4]), p[5]) for p in h[4] ],
+        [ InterfacePort(*p) for p in h[5] ],
+        [ InterfacePort(*p) for p in h[6] ],
+        [ InterfacePort(*p) for p in h[7] ],
+    )
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1<<20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class ModuleIndex(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version != INDEX_VERSION:
+            # stale index: start from scratch
+            for table in ('interfaces', 'ports', 'parameters', 'modules', 'files'):
+                self.db.execute("DROP TABLE IF EXISTS %s" % table)
+            self.db.execute("PRAGMA user_version = %d" % INDEX_VERSION)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def update(self, paths):
+        # (re)index the files, directories and globs in paths; only files
+        # whose mtime/size and then content hash changed are parsed again.
+        # Returns the number of files parsed.
+        parsed = 0
+        seen = set()
+        with self.db:
+            for path in prettyplot.expand_paths(paths):
+                path = os.path.abspath(path)
+                seen.add(path)
+                try:
+                    st = os.stat(path)
+                    row = self.db.execute("SELECT mtime, size, hash FROM files WHERE path = ?", (path, )).fetchone()
+                    if row is not None and row[0] == st.st_mtime and row[1] == st.st_size:
+                        continue
+                    h = file_hash(path)
+                except FileNotFoundError:
+                    # listed explicitly but missing, or removed since the
+                    # glob: forget it rather than failing the whole update
+                    self.db.execute("DELETE FROM files WHERE path = ?", (path, ))
+                    continue
+                if row is not None and row[2] == h:
+                    self.db.execute("UPDATE files SET mtime = ?, size = ? WHERE path = ?", (st.st_mtime, st.st_size, path))
+                    continue
+                self.index_file(path, st, h)
+                parsed += 1
+            # forget files that have disappeared from the indexed directories
+            roots = tuple(os.path.abspath(p) + os.sep for p in paths if os.path.isdir(p))
+            for (path, ) in self.db.execute("SELECT path FROM files").fetchall():
+                if path not in seen and path.startswith(roots) and not os.path.exists(path):
+                    self.db.execute("DELETE FROM files WHERE path = ?", (path, ))
+        return parsed
+
+    def index_file(self, path, st, h):
+        self.db.execute("DELETE FROM files WHERE path = ?", (path, ))
+        self.db.execute("INSERT INTO files VALUES (?, ?, ?, ?)", (path, st.st_mtime, st.st_size, h))
+        try:
+            modules = list(prettyplot.iter_modules(path, skip_errors=True))
+        except Exception:
+            # indexed without modules, so that one bad file neither stops
+            # nor rolls back the update
+            return
+        for module, comments in modules:
+            self.db.execute("INSERT INTO modules VALUES (?, ?, ?, ?)", (module.name, path, json.dumps(module), json.dumps(comments)))
+            self.db.executemany("INSERT INTO parameters VALUES (?, ?, ?, ?)", [ (module.name, path, p.name.strip(), p.value) for p in module.parameters ])
+            self.db.executemany("INSERT INTO ports VALUES (?, ?, ?, ?, ?)", [ (module.name, path, p.name, p.direction, p.type) for p in module.input_ports + module.output_ports + module.inout_ports ])
+            interfaces = [ (module.name, path, p.name, p.interface, p.modport, 'incoming') for p in module.incoming_interfaces ]
+            interfaces += [ (module.name, path, p.name, p.interface, p.modport, 'outgoing') for p in module.outgoing_interfaces ]
+            interfaces += [ (module.name, path, p.name, p.interface, p.modport, None) for p in module.interfaces ]
+            self.db.executemany("INSERT INTO interfaces VALUES (?, ?, ?, ?, ?, ?)", interfaces)
+
+    def find(self, name):
+        # (path, ModuleHeader, comments) for the module called name, or None
+        row = self.db.execute("SELECT path, header, comments FROM modules WHERE name = ? ORDER BY path LIMIT 1", (name, )).fetchone()
+        if row is None:
+            return None
+        return row[0], header_from_json(row[1]), tuple(json.loads(row[2]))
+
+    def modules(self):
+        # list of (name, path) of all indexed modules
+        return self.db.execute("SELECT name, path FROM modules ORDER BY name, path").fetchall()
+
+    def modules_with_interface(self, interface, modport=None):
+        # list of (module, path, port name, modport) exposing interface
+        if modport is None:
+            return self.db.execute("SELECT module, path, name, modport FROM interfaces WHERE interface = ? ORDER BY module, name", (interface, )).fetchall()
+        return self.db.execute("SELECT module, path, name, modport FROM interfaces WHERE interface = ? AND modport = ? ORDER BY module, name", (interface, modport)).fetchall()
+
+    def modules_with_parameter(self, name):
+        return self.db.execute("SELECT module, path, value FROM parameters WHERE name = ? ORDER BY module", (name, )).fetchall()
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Index the SystemVerilog modules of an RTL tree.")
+    parser.add_argument('index', help="index database")
+    parser.add_argument('paths', nargs='*', help=".sv files, directories or globs to (re)index")
+    parser.add_argument('--module', default=None, help="print the file declaring this module")
+    parser.add_argument('--interface', default=None, help="list the modules exposing this interface")
+    args = parser.parse_args(argv)
+
+    index = ModuleIndex(args.index)
+    if len(args.paths) > 0:
+        print("%d files parsed" % index.update(args.paths))
+    if args.module is not None:
+        found = index.find(args.module)
+        print(args.module if found is None else "%s %s" % (args.module, found[0]))
+    if args.interface is not None:
+        for module, path, name, modport in index.modules_with_interface(args.interface):
+            print("%s.%s (%s) %s" % (module, name, modport, path))
+    index.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
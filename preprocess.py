@@ -0,0 +1,377 @@
+# optional SystemVerilog preprocessing: `define/`undef, `ifdef/`ifndef/
+# `elsif/`else/`endif and `include expansion, plus the parameters of the
+# packages in the included files or listed explicitly, so that the ranges
+# of the ports can be shown with concrete widths
+
+import os
+import re
+import ast
+import svprettyplot.prettyplot as prettyplot
+
+# (path, include dirs, defines) -> (text, defines, constants, files) for
+# every file loaded by a Preprocessor, where files lists the (path, mtime)
+# of the file and of those it includes, checked before each reuse; shared by
+# all of them in a process, so that a batch expands each common header once
+MEMO = {}
+
+MAX_DEPTH = 32
+
+DIRECTIVE = re.compile(prettyplot.SCAN_COMMENT + r'|`(\w+)', re.DOTALL)
+DEFINE    = re.compile(r'[ \t]+(\w+)(\([^)\n]*\))?[ \t]*((?:/\*(?:[^*]|\*(?!/))*\*/|[^\n\\]|\\\n?)*)')
+# comments (and strings, kept) in the text of a `define
+MACRO_COMMENT = re.compile(prettyplot.SCAN_COMMENT, re.DOTALL)
+MACRO_ARG = re.compile(r'[ \t]+(\w+)')
+INCLUDE   = re.compile(r'[ \t]*(?:"([^"\n]*)"|<([^>\n]*)>)')
+REST_OF_LINE = re.compile(r'[^\n]*')
+# directives dropped together with the rest of their line
+LINE_DIRECTIVES = ( 'timescale', 'default_nettype', 'resetall', 'celldefine', 'endcelldefine', 'pragma', 'line', 'begin_keywords', 'end_keywords' )
+
+PACKAGE   = re.compile(r'(?<![\w$])package\s+(\w+)\s*;(.*?)(?<![\w$])endpackage\b', re.DOTALL)
+CONSTANT  = re.compile(r'(?<![\w$])(?:parameter|localparam)\b([^;]*);')
+ASSIGN    = re.compile(r'(\w+)\s*(?:\[[^\]]*\]\s*)*=\s*(.*)$', re.DOTALL)
+IMPORT    = re.compile(r'(?<![\w$])import\s+(\w+)::(\w+|\*)\s*(?:,\s*(\w+)::(\w+|\*)\s*)*;')
+IMPORT_ITEM = re.compile(r'(\w+)::(\w+|\*)')
+QUALIFIED = re.compile(prettyplot.SCAN_COMMENT + r'|' + IMPORT.pattern + r'|(?<![\w$])(\w+)::(\w+)', re.DOTALL)
+SV_NUMBER = re.compile(r"(?:\d[\d_]*)?\s*'[sS]?([dDhHbBoO])\s*([0-9a-fA-F_]+)")
+RANGE_BOUNDS = re.compile(r'\[\s*(.*?)\s*:\s*(.*?)\s*\]\s*$', re.DOTALL)
+
+class Preprocessor(object):
+
+    def __init__(self, include_dirs=(), defines=None, packages=(), memo=None):
+        # defines maps names to their text (None for a bare `define);
+        # packages lists files whose packages are always loaded
+        self.include_dirs = tuple(include_dirs)
+        self.defines = tuple(sorted((name, (None, body or '')) for name, body in (defines or {}).items()))
+        self.packages = tuple(packages)
+        self.memo = MEMO if memo is None else memo
+
+    def __getstate__(self):
+        # the memo stays in its process (see MEMO)
+        state = dict(self.__dict__)
+        state['memo'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.memo is None:
+            self.memo = MEMO
+
+    def run(self, code, path=None, files=None):
+        # (expanded code, constants) where constants maps pkg::NAME, and NAME
+        # for imported names, to integer values; the paths of the files
+        # loaded (packages and includes) are added to the set files
+        defines = dict(self.defines)
+        constants = {}
+        loaded = []
+        try:
+            for package in self.packages:
+                _, _, package_constants = self.load(package, defines, loaded)
+                constants.update(package_constants)
+            directory = os.path.dirname(os.path.abspath(path)) if path is not None else os.getcwd()
+            text, included = self.expand(code, defines, directory, 0, loaded)
+        finally:
+            if files is not None:
+                files.update(p for p, _ in loaded)
+        constants.update(included)
+        constants.update(package_constants_of(prettyplot.scan_comments(text)[1], constants))
+        imported = {}
+        def substitute(m):
+            if m.group(1) is not None:
+                # import statement: make the names visible, drop the statement
+                for pkg, name in IMPORT_ITEM.findall(m.group(0)):
+                    prefix = pkg + '::'
+                    for k, v in constants.items():
+                        if k.startswith(prefix) and (name == '*' or k == prefix+name):
+                            imported[k[len(prefix):]] = v
+                return ' '
+            if m.group(5) is not None:
+                value = constants.get('%s::%s' % (m.group(5), m.group(6)))
+                return m.group(0) if value is None else str(value)
+            return m.group(0)
+        text = QUALIFIED.sub(substitute, text)
+        constants.update(imported)
+        return text, constants
+
+    def resolve(self, module, constants):
+        return resolve_module(module, constants)
+
+    def load(self, path, defines, files):
+        # (comment-free expanded text, defines after it, constants of its
+        # packages) for an included or package file, memoized; the (path,
+        # mtime) of the files it loads are appended to files
+        path = os.path.abspath(path)
+        key = (path, self.include_dirs, tuple(sorted(defines.items())))
+        entry = self.memo.get(key)
+        if entry is None or any(mtime_ns(p) != mtime for p, mtime in entry[3]):
+            loaded = [ (path, mtime_ns(path)) ]
+            with open(path, "r") as f:
+                code = f.read()
+            file_defines = dict(defines)
+            try:
+                text, constants = self.expand(code, file_defines, os.path.dirname(path), 1, loaded)
+            except prettyplot.ParseError as e:
+                files.extend(loaded)
+                if e.pos is not None:
+                    e.line = prettyplot.source_line(code, e.pos)
+                raise prettyplot.ParseError('%s: %s' % (path, e))
+            text = prettyplot.scan_comments(text)[1]
+            constants.update(package_constants_of(text, constants))
+            entry = self.memo[key] = (text, tuple(sorted(file_defines.items())), constants, tuple(loaded))
+        text, file_defines, constants, loaded = entry
+        files.extend(loaded)
+        defines.clear()
+        defines.update(file_defines)
+        return text, defines, constants
+
+    def find_include(self, name, directory):
+        for d in (directory, ) + self.include_dirs:
+            path = os.path.join(d, name)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def expand(self, code, defines, directory, depth, files):
+        # expand code with defines (updated in place); returns the text and
+        # the constants of the packages in the included files, whose (path,
+        # mtime) are appended to files
+        if depth > MAX_DEPTH:
+            raise prettyplot.ParseError("`include or macro nesting deeper than %d" % MAX_DEPTH)
+        out = []
+        constants = {}
+        # one entry per open `ifdef: (enclosing branch active, a branch was taken)
+        conditions = []
+        active = True
+        pos = 0
+        while True:
+            m = DIRECTIVE.search(code, pos)
+            if m is None:
+                if active:
+                    out.append(code[pos:])
+                break
+            if active:
+                out.append(code[pos:m.start()])
+            pos = m.end()
+            name = m.group(1)
+            if name is None:
+                # comment or string
+                if active:
+                    out.append(m.group(0))
+            elif name in ('ifdef', 'ifndef', 'elsif'):
+                arg = MACRO_ARG.match(code, pos)
+                if arg is None:
+                    raise prettyplot.ParseError("`%s without a macro name" % name, pos=pos)
+                pos = arg.end()
+                defined = arg.group(1) in defines
+                if name == 'elsif':
+                    if len(conditions) == 0:
+                        raise prettyplot.ParseError("`elsif without `ifdef", pos=m.start())
+                    outer, taken = conditions[-1]
+                    active = outer and not taken and defined
+                    conditions[-1] = (outer, taken or active)
+                else:
+                    outer = active
+                    active = outer and (defined if name == 'ifdef' else not defined)
+                    conditions.append((outer, active))
+            elif name == 'else':
+                if len(conditions) == 0:
+                    raise prettyplot.ParseError("`else without `ifdef", pos=m.start())
+                outer, taken = conditions[-1]
+                active = outer and not taken
+                conditions[-1] = (outer, True)
+            elif name == 'endif':
+                if len(conditions) == 0:
+                    raise prettyplot.ParseError("`endif without `ifdef", pos=m.start())
+                active = conditions.pop()[0]
+            elif not active:
+                continue
+            elif name == 'define':
+                d = DEFINE.match(code, pos)
+                if d is None:
+                    raise prettyplot.ParseError("`define without a macro name", pos=pos)
+                pos = d.end()
+                params = tuple(p.strip() for p in d.group(2)[1:-1].split(',')) if d.group(2) else None
+                # comments are not part of the macro text
+                body = MACRO_COMMENT.sub(lambda c: c.group(0) if c.group(0)[0] == '"' else ' ', re.sub(r'\\\n', '\n', d.group(3)))
+                defines[d.group(1)] = (params, body.strip())
+            elif name == 'undef':
+                arg = MACRO_ARG.match(code, pos)
+                if arg is not None:
+                    pos = arg.end()
+                    defines.pop(arg.group(1), None)
+            elif name == 'include':
+                inc = INCLUDE.match(code, pos)
+                if inc is None:
+                    raise prettyplot.ParseError("`include without a file name", pos=pos)
+                pos = inc.end()
+                path = self.find_include(inc.group(1) or inc.group(2), directory)
+                if path is None:
+                    raise prettyplot.ParseError("`include file %s not found" % (inc.group(1) or inc.group(2)), pos=m.start())
+                text, _, included = self.load(path, defines, files)
+                out.append(text)
+                constants.update(included)
+            elif name in LINE_DIRECTIVES:
+                pos = REST_OF_LINE.match(code, pos).end()
+            elif name in defines:
+                params, body = defines[name]
+                if params is not None:
+                    args, pos = macro_args(code, pos)
+                    if args is None:
+                        raise prettyplot.ParseError("macro `%s needs arguments" % name, pos=m.start())
+                    values = dict(zip(params, args + ['']*(len(params)-len(args))))
+                    body = re.sub(r'(?<![\w$])(\w+)\b', lambda a: values.get(a.group(1), a.group(1)), body)
+                text, included = self.expand(body, defines, directory, depth+1, files)
+                out.append(text)
+                constants.update(included)
+            else:
+                # unknown macro: left as is
+                out.append(m.group(0))
+        if len(conditions) > 0:
+            raise prettyplot.ParseError("missing `endif", pos=len(code))
+        return ''.join(out), constants
+
+def mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def macro_args(code, pos):
+    # ([args], end) for the parenthesized arguments at pos, or (None, pos)
+    m = re.compile(r'[ \t]*\(').match(code, pos)
+    if m is None:
+        return None, pos
+    args = []
+    depth = 0
+    start = m.end()
+    for i in range(m.end(), len(code)):
+        c = code[i]
+        if c in '([{':
+            depth += 1
+        elif c in ')]}' and depth > 0:
+            depth -= 1
+        elif c == ',' and depth == 0:
+            args.append(code[start:i].strip())
+            start = i+1
+        elif c == ')':
+            args.append(code[start:i].strip())
+            return args, i+1
+    return None, pos
+
+def package_constants_of(text, constants):
+    # pkg::NAME -> value for the parameters of the packages in text that
+    # evaluate to integers; inside a package, its own names are visible
+    found = {}
+    for pkg, body in PACKAGE.findall(text):
+        local = dict(constants)
+        for decl in CONSTANT.findall(body):
+            for item in split_top_level(decl):
+                m = ASSIGN.search(item)
+                if m is None:
+                    continue
+                value = evaluate(m.group(2), local)
+                if value is not None:
+                    local[m.group(1)] = value
+                    found['%s::%s' % (pkg, m.group(1))] = value
+    return found
+
+def split_top_level(s):
+    # split s on the commas that are not nested in brackets
+    items = []
+    depth = 0
+    start = 0
+    for i, c in enumerate(s):
+        if c in '([{':
+            depth += 1
+        elif c in ')]}':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            items.append(s[start:i])
+            start = i+1
+    items.append(s[start:])
+    return items
+
+def clog2(x):
+    return (x-1).bit_length() if x > 0 else 0
+
+BINARY_OPS = {
+    ast.Add      : lambda a, b: a + b,
+    ast.Sub      : lambda a, b: a - b,
+    ast.Mult     : lambda a, b: a * b,
+    # integer division truncates towards zero in SystemVerilog
+    ast.Div      : lambda a, b: abs(a) // abs(b) * (1 if (a < 0) == (b < 0) else -1),
+    ast.Mod      : lambda a, b: abs(a) % abs(b) * (1 if a >= 0 else -1),
+    ast.Pow      : lambda a, b: a ** b,
+    ast.LShift   : lambda a, b: a << b,
+    ast.RShift   : lambda a, b: a >> b,
+    ast.BitAnd   : lambda a, b: a & b,
+    ast.BitOr    : lambda a, b: a | b,
+    ast.BitXor   : lambda a, b: a ^ b,
+}
+
+UNARY_OPS = {
+    ast.USub     : lambda a: -a,
+    ast.UAdd     : lambda a: a,
+    ast.Invert   : lambda a: ~a,
+}
+
+def sv_number(m):
+    base = { 'd' : 10, 'h' : 16, 'b' : 2, 'o' : 8 }[m.group(1).lower()]
+    return str(int(m.group(2).replace('_', ''), base))
+
+def evaluate(expr, constants):
+    # integer value of a constant expression, or None
+    expr = SV_NUMBER.sub(sv_number, expr.strip()).replace('$clog2', 'clog2').replace('::', '__PKG__')
+    try:
+        return evaluate_node(ast.parse(expr, mode='eval').body, constants)
+    except (SyntaxError, ValueError, KeyError, TypeError, ZeroDivisionError, OverflowError, RecursionError):
+        return None
+
+def evaluate_node(node, constants):
+    if isinstance(node, ast.Constant) and type(node.value) is int:
+        return node.value
+    if isinstance(node, ast.Name):
+        return constants[node.id.replace('__PKG__', '::')]
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPS:
+        b = evaluate_node(node.right, constants)
+        if isinstance(node.op, ast.Pow) and abs(b) > 64:
+            raise OverflowError
+        return BINARY_OPS[type(node.op)](evaluate_node(node.left, constants), b)
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPS:
+        return UNARY_OPS[type(node.op)](evaluate_node(node.operand, constants))
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'clog2' and len(node.args) == 1 and len(node.keywords) == 0:
+        return clog2(evaluate_node(node.args[0], constants))
+    raise ValueError("not a constant expression")
+
+def resolve_range(r, constants):
+    # '[WIDTH-1:0]' -> '[31:0]' when both bounds evaluate, else r unchanged
+    m = RANGE_BOUNDS.match(r)
+    if m is None:
+        return r
+    msb, lsb = evaluate(m.group(1), constants), evaluate(m.group(2), constants)
+    if msb is None or lsb is None:
+        return r
+    return '[%d:%d]' % (msb, lsb)
+
+def resolve_module(module, constants):
+    # the module with the ranges of its ports evaluated, using constants and
+    # the default values of the module parameters
+    env = dict(constants)
+    for p in module.parameters:
+        value = evaluate(p.value, env)
+        if value is not None:
+            env[p.name.strip()] = value
+    def ports(ports):
+        resolved = []
+        for p in ports:
+            if 'packed' in p._fields:
+                p = p._replace(packed=tuple(resolve_range(r, env) for r in p.packed))
+            resolved.append(p._replace(unpacked=resolve_range(p.unpacked, env)))
+        return resolved
+    return module._replace(
+        input_ports         = ports(module.input_ports),
+        output_ports        = ports(module.output_ports),
+        inout_ports         = ports(module.inout_ports),
+        interfaces          = ports(module.interfaces),
+        incoming_interfaces = ports(module.incoming_interfaces),
+        outgoing_interfaces = ports(module.outgoing_interfaces),
+    )
@@ -1,21 +1,61 @@
 # parser for SV module headers
 
+import os
 import re
-from collections import OrderedDict
-import pydotplus
+import sys
+import io
+import time
+import math
+import bisect
+import glob
+import itertools
+import shutil
+import subprocess
+from collections import OrderedDict, namedtuple
 
 # used pythex.org to help put together the regexes!
 
+# the patterns are built from atomic groups, so that each one runs in time
+# linear in the text it looks at and never backtracks on malformed input; a
+# range is [msb:lsb] and any number of packed ranges are captured together
+# and split by interpret_systemverilog; expressions may hold balanced
+# parentheses, up to PAREN_DEPTH levels deep
+PAREN_DEPTH = 16
+
+# atomic groups and possessive quantifiers are only in re from Python 3.11
+# on; atomic(p) behaves as (?>p) on every version: the lookahead matches p
+# once and the backreference consumes that text, so the engine never
+# backtracks into it. The groups it adds are named _atomicN and are left out
+# of the token fields (see compile_tokens)
+ATOMIC_GROUPS = itertools.count()
+
+def atomic(pattern):
+    name = '_atomic%d' % next(ATOMIC_GROUPS)
+    return r'(?=(?P<%s>%s))(?P=%s)' % (name, pattern, name)
+
+# these are functions as the names of the atomic groups must be unique
+# within a pattern
+def expr_pattern():
+    # within parentheses a run of characters is always taken whole, so that
+    # the text splits in a single way into runs and nested parentheses
+    paren = r'\([\w\-\+\*\/\%\$\s]*\)'
+    for i in range(PAREN_DEPTH-1):
+        paren = r'\((?:[\w\-\+\*\/\%\$\s]+(?![\w\-\+\*\/\%\$\s])|' + paren + r')*\)'
+    return atomic(r'(?:[\w\-\+\*\/\%\$]+|' + paren + r')+')
+
+def range_pattern():
+    return r'\[\s*' + expr_pattern() + r'\s*\:\s*' + expr_pattern() + r'\s*\]'
+
 TOKENS = OrderedDict([
-    ( 'MODULE_KEYWORD',       r'.*module\s*'                                                                                                      ),
+    ( 'MODULE_KEYWORD',       r'\A' + atomic(r'(?:[^"m]+|"(?:[^"\\\n]|\\.)*"?|(?<=[\w$])m|m(?!odule\b))*') + r'module\b\s*'                  ),
     ( 'MODULE_NAME',          r'\A(\D\w*)\s*'                                                                                                     ),
     ( 'PARAMETER_LIST_START', r'\A\#\(\s*'                                                                                                        ),
     ( 'PARAMETER_LIST_COMMA', r'\A\,\s*'                                                                                                          ),
-    ( 'PARAMETER_DECL',       r'\Aparameter\s*(logic|wire|reg|int|integer)?\s*(signed|unsigned)?(\D\w*)\s*=\s*([\w\-\+\*\/\%\$\(\)]+)\s*'         ),
+    ( 'PARAMETER_DECL',       r'\Aparameter\b' + atomic(r'\s*(?:(logic|wire|reg|int|integer)\b)?\s*(?:(signed|unsigned)\b)?') + r'(\D\w*)\s*=\s*(' + expr_pattern() + r')\s*' ),
     ( 'PORT_LIST_START',      r'\A\(\s*'                                                                                                          ),
     ( 'PORT_LIST_COMMA',      r'\A\,\s*'                                                                                                          ),
-    ( 'PORT_DECL', r'\A(input|output|inout)?\s*(\w+)?\s*(signed|unsigned)?\s*(\[\s*[\w\-\+\*\/\%\$\(\)]+\s*\:\s*[\w\-\+\*\/\%\$\(\)]+\s*\])?\s*(\[\s*[\w\-\+\*\/\%\$\(\)]+\s*\:\s*[\w\-\+\*\/\%\$\(\)]+\s*\])?\s*(\[\s*[\w\-\+\*\/\%\$\(\)]+\s*\:\s*[\w\-\+\*\/\%\$\(\)]+\s*\])?\s*(\[\s*[\w\-\+\*\/\%\$\(\)]+\s*\:\s*[\w\-\+\*\/\%\$\(\)]+\s*\])?\s*(\w+)\s*(\[\s*[\w\-\+\*\/\%\$\(\)]+\s*\:\s*[\w\-\+\*\/\%\$\(\)]+\s*\])?\s*'),
-    ( 'PORT_DECL_INTF',       r'\A(\D\w*)\.(\D\w*)\s+(\D\w*)\s*(\[\s*[\w\-\+\*\/\%\$\(\)]+\s*\:\s*[\w\-\+\*\/\%\$\(\)]+\s*\]\s*)?'                ),
+    ( 'PORT_DECL',            r'\A' + atomic(r'(?:(input|output|inout)\b)?\s*(?:(\w+)\b(?=\s*(?:' + range_pattern() + r'\s*)*\w))?\s*(?:(signed|unsigned)\b)?\s*((?:' + range_pattern() + r')(?:\s*' + range_pattern() + r')*)?\s*') + r'(\w+)\s*(' + range_pattern() + r')?\s*' ),
+    ( 'PORT_DECL_INTF',       r'\A(\D\w*)\.(\D\w*)' + atomic(r'\s+') + r'(\D\w*)\s*(' + range_pattern() + r'\s*)?'                                         ),
     ( 'LIST_STOP',            r'\A\)\s*'                                                                                                          ),
     ( 'DECL_END',             r'\A\;\s*'                                                                                                          )
 ])
@@ -28,7 +68,7 @@ MATCHES = OrderedDict([
     ( 'PARAMETER_DECL',       ( 'type', 'sign', 'name', 'value', ) ),
     ( 'PORT_LIST_START',      (  ) ),
     ( 'PORT_LIST_COMMA',      (  ) ),
-    ( 'PORT_DECL',            ( 'direction', 'type', 'sign', 'packed0', 'packed1', 'packed2', 'packed3', 'name', 'unpacked', ) ),
+    ( 'PORT_DECL',            ( 'direction', 'type', 'sign', 'packed', 'name', 'unpacked', ) ),
     ( 'PORT_DECL_INTF',       ( 'interface', 'modport', 'name', 'unpacked', ) ),
     ( 'LIST_STOP',            (  ) ),
     ( 'DECL_END',             (  ) )
@@ -53,28 +93,140 @@ FOLLOWS = OrderedDict([
 INTERFACES_INCOMING_MODPORTS = ( 'slave', 'sink', 'monitor', 'target' )
 INTERFACES_OUTGOING_MODPORTS = ( 'master', 'source', 'initiator' )
 
+def compile_tokens(tokens_list=TOKENS):
+    # precompile the token patterns once; patterns anchored with \A are
+    # matched at the current position, the others are searched from it; the
+    # numbers of the groups holding the fields skip those of atomic groups
+    compiled = OrderedDict([])
+    for name, pattern in tokens_list.items():
+        anchored = pattern.startswith(r'\A')
+        regex = re.compile(pattern[2:] if anchored else pattern)
+        skipped = set(i for g, i in regex.groupindex.items() if g.startswith('_atomic'))
+        groups = tuple(i for i in range(1, regex.groups+1) if i not in skipped)
+        compiled[name] = (regex, anchored, groups)
+    return compiled
+
+# compiled on first use, which keeps the import cheap
+COMPILED_TOKENS = None
+
+# optional instrumentation: while STATS is a Stats (see enable_stats) the
+# pipeline records the wall time of each stage and a few counters for the
+# file being processed; when it is None the only cost is that test
+STATS = None
+
+class Stats(object):
+
+    def __init__(self, callback=None):
+        # path -> record, a dict with 'times' (stage -> s), 'counters'
+        # (name -> n) and 'attempts' ('A->B' -> regex attempts of the FOLLOWS
+        # transition); callback(path, record) is called when a file is done
+        self.files = OrderedDict([])
+        self.callback = callback
+        self.path = None
+        self.record = self.new_record()
+
+    @staticmethod
+    def new_record():
+        return dict(times={}, counters={}, attempts={})
+
+    def begin(self, path):
+        self.path = path
+        self.record = self.files.setdefault(path, self.new_record())
+        self.start = time.perf_counter()
+
+    def end(self):
+        self.time('total', time.perf_counter()-self.start)
+        if self.callback is not None:
+            self.callback(self.path, self.record)
+        self.path = None
+        self.record = self.new_record()
+
+    def time(self, stage, t):
+        times = self.record['times']
+        times[stage] = times.get(stage, 0.0) + t
+
+    def count(self, name, n=1):
+        counters = self.record['counters']
+        counters[name] = counters.get(name, 0) + n
+
+    def merge(self, files):
+        # add the records of another Stats (e.g. from a worker process)
+        for path, other in files.items():
+            record = self.files.setdefault(path, self.new_record())
+            for kind in ('times', 'counters', 'attempts'):
+                for k, v in other[kind].items():
+                    record[kind][k] = record[kind].get(k, 0) + v
+            if self.callback is not None:
+                self.callback(path, record)
+
+    def totals(self):
+        # one record summing all files
+        total = self.new_record()
+        for record in self.files.values():
+            for kind in ('times', 'counters', 'attempts'):
+                for k, v in record[kind].items():
+                    total[kind][k] = total[kind].get(k, 0) + v
+        return total
+
+    def slowest(self, n=10):
+        # the n (path, record) with the longest total time
+        return sorted(self.files.items(), key=lambda item: -item[1]['times'].get('total', 0.0))[:n]
+
+def enable_stats(callback=None):
+    global STATS
+    STATS = Stats(callback)
+    return STATS
+
+def disable_stats():
+    global STATS
+    stats, STATS = STATS, None
+    return stats
+
+class ParseError(Exception):
+
+    def __init__(self, message, token=None, pos=None, line=None):
+        super(ParseError, self).__init__(message)
+        self.token = token
+        self.pos = pos
+        self.line = line
+
+    def __str__(self):
+        s = super(ParseError, self).__str__()
+        return s if self.line is None else 'line %d: %s' % (self.line, s)
+
 def tokenize_and_parse(code, verbose=False, follows_list=FOLLOWS, tokens_list=TOKENS, matches_list=MATCHES):
     # tokenize & parse
+    global COMPILED_TOKENS
+    if tokens_list is not TOKENS:
+        compiled = compile_tokens(tokens_list)
+    else:
+        if COMPILED_TOKENS is None:
+            COMPILED_TOKENS = compile_tokens(TOKENS)
+        compiled = COMPILED_TOKENS
+    attempts = STATS.record['attempts'] if STATS is not None else None
     tokens = [] # set up token list
     curr_token = 'ROOT' # look for "model" keyword
+    pos = 0 # current offset in code, which is never copied
     while True:
-        flag = True
+        m = None
         for next_token in follows_list[curr_token]:
-            pattern = tokens_list[next_token]
-            split = re.split(pattern, code, maxsplit=1)
-            if len(split) > 1:
-                flag = False
+            pattern, anchored, groups = compiled[next_token]
+            if attempts is not None:
+                transition = curr_token+'->'+next_token
+                attempts[transition] = attempts.get(transition, 0) + 1
+            m = pattern.match(code, pos) if anchored else pattern.search(code, pos)
+            if m is not None:
                 break
-        if flag:
-            print("ERROR @%s" % next_token)
-            print("REMAINING CODE:", code)
-            return None
-        # next code is given by split[-1]
-        code = split[-1]
+        if m is None:
+            raise ParseError("expected %s at offset %d: %r" % (' or '.join(follows_list[curr_token]), pos, code[pos:pos+40]), token=next_token, pos=pos)
+        # next code starts at the end of the match
+        pos = m.end()
         token = OrderedDict([])
         token['token_type'] = next_token
-        for i,m in enumerate(matches_list[next_token]):
-            token[m] = split[1+i]
+        for i,g in enumerate(matches_list[next_token]):
+            token[g] = m.group(groups[i])
+        token['start'] = m.start()
+        token['end'] = pos
         tokens.append(token)
         if verbose:
             print(token)
@@ -132,55 +284,281 @@ def remove_comments(code):
     code = ''.join(clean_split)
     return code
 
+# a run of code and plain // comments, up to the next /*, //*, or */; the
+# alternatives start differently and nothing follows the repetition, so the
+# match never backtracks
+CODE_RUN           = re.compile(r'(?:[^/*]+|/(?![/*])|\*(?!/)|//(?!\*)[^\n]*\n?)*')
+LINE_COMMENT       = re.compile(r'//[^\n]*\n?')
+LONG_COMMENT_STAR  = re.compile(r'^\s*\* ', re.MULTILINE)
+LONG_COMMENT_BLANK = re.compile(r'^\s*\*\s', re.MULTILINE)
+
+def scan_comments(code):
+    # single pass replacement of get_rst_comments + remove_comments: returns
+    # the RST comments, the comment-free code and an offset map made of
+    # (offset in comment-free code, start, end in code) triplets, one per
+    # run of code; line comments within a run are folded into a blank
+    long_comments = []
+    short_comments = []
+    clean = []
+    offset_map = []
+    clean_len = 0
+    pos = 0
+    n = len(code)
+    while pos < n:
+        end = CODE_RUN.match(code, pos).end()
+        if end > pos:
+            s = code[pos:end]
+            if '//' in s:
+                s = LINE_COMMENT.sub(' ', s)
+            offset_map.append((clean_len, pos, end))
+            clean.append(s)
+            clean_len += len(s)
+        if end == n:
+            break
+        if code.startswith('//*', end):
+            # RST short comment, replaced by a blank
+            pos = code.find('\n', end)
+            pos = n if pos < 0 else pos
+            short_comments.append(' ' + code[end+3:pos].lstrip(' \t\r\f\v'))
+            clean.append(' ')
+            clean_len += 1
+            pos += 1
+        elif code.startswith('/*', end):
+            # block comment, dropped; /** */ comments are RST (/**/ is empty)
+            pos = code.find('*/', end+2)
+            pos = n if pos < 0 else pos
+            if code.startswith('/**', end) and pos > end+2:
+                s = LONG_COMMENT_STAR.sub('', code[end+3:pos])
+                long_comments.append(LONG_COMMENT_BLANK.sub('\n', s))
+            pos += 2
+        else:
+            # stray */, dropped
+            pos = end+2
+    return (long_comments, short_comments), ''.join(clean), offset_map
+
+def source_offset(code, offset_map, pos):
+    # map an offset in the comment-free code back to the original code
+    i = bisect.bisect_right(offset_map, (pos, math.inf)) - 1
+    if i < 0:
+        return pos
+    clean_start, start, end = offset_map[i]
+    offset = start + pos - clean_start
+    for m in LINE_COMMENT.finditer(code, start, end):
+        if m.start() >= offset:
+            break
+        offset += len(m.group(0)) - 1
+    return offset
+
+def source_line(code, offset):
+    return code.count('\n', 0, offset) + 1
+
 def tokenize_systemverilog(code, verbose=False):
-    # get RST comments
-    comments = get_rst_comments(code)
-    # remove all comments
-    code = remove_comments(code)
+    # get RST comments and remove all comments
+    stats = STATS
+    if stats is not None:
+        stats.count('bytes_scanned', len(code))
+        t0 = time.perf_counter()
+    comments, clean_code, offset_map = scan_comments(code)
+    if stats is not None:
+        t1 = time.perf_counter()
+        stats.time('comments', t1-t0)
     # tokenize & parse
-    return tokenize_and_parse(code, verbose=verbose), comments
+    try:
+        tokens = tokenize_and_parse(clean_code, verbose=verbose)
+    except ParseError as e:
+        e.line = source_line(code, source_offset(code, offset_map, e.pos))
+        raise
+    if stats is not None:
+        stats.time('tokenize', time.perf_counter()-t1)
+        stats.count('tokens', len(tokens))
+    return tokens, comments
+
+# scanners used by iter_modules: comments and strings are always skipped,
+# then each state looks for the keyword or punctuation that ends it
+SCAN_COMMENT = r'//[^\n]*(?:\n|\Z)|/\*.*?(?:\*/|\Z)|"(?:\\.|[^"\\\n])*(?:"|\Z)'
+SCAN = {
+    'OUTSIDE' : re.compile(SCAN_COMMENT + r'|(?<![\w$])module\b', re.DOTALL),
+    'HEADER'  : re.compile(SCAN_COMMENT + r'|[();]',                re.DOTALL),
+    'BODY'    : re.compile(SCAN_COMMENT + r'|(?<![\w$])endmodule\b', re.DOTALL),
+}
+# longest partial match that can be left at the end of a chunk
+SCAN_TAIL = len('endmodule')
+
+def interpret_module_text(doc, skip_errors=False):
+    # doc holds the RST comments around the module and its header text
+    try:
+        tokens, comments = tokenize_systemverilog(''.join(doc))
+        return interpret_systemverilog(tokens), comments
+    except ParseError:
+        if skip_errors:
+            return None
+        raise
+
+def iter_modules(path_or_stream, chunk_size=65536, skip_errors=False):
+    # yield (module, comments) for every module declared in a file, reading
+    # it in chunks and skipping module bodies up to endmodule; only the
+    # current header and the RST comments are held in memory
+    if isinstance(path_or_stream, str):
+        with open(path_or_stream, "r") as f:
+            yield from iter_modules(f, chunk_size=chunk_size, skip_errors=skip_errors)
+        return
+    stream = path_or_stream
+    buf = ''
+    pos = 0
+    eof = False
+    state = 'OUTSIDE'
+    depth = 0
+    header_start = None
+    doc = []
+    while True:
+        m = SCAN[state].search(buf, pos)
+        if m is None or (m.end() == len(buf) and not eof):
+            if eof:
+                break
+            # need more input: drop the consumed part of the buffer, keeping
+            # one character for the keyword lookbehind
+            if m is None:
+                pos = max(pos, len(buf)-SCAN_TAIL)
+            keep = pos if header_start is None else header_start
+            cut = max(keep-1, 0)
+            buf = buf[cut:]
+            pos -= cut
+            if header_start is not None:
+                header_start -= cut
+            chunk = stream.read(chunk_size)
+            if STATS is not None:
+                STATS.count('bytes_read', len(chunk))
+            if len(chunk) == 0:
+                eof = True
+            buf += chunk
+            continue
+        pos = m.end()
+        text = m.group(0)
+        if text[0] in '/"':
+            # RST comments are kept, everything else is dropped; comments in
+            # the header are kept with the header text
+            if state != 'HEADER' and ((text.startswith('/**') and text != '/**/') or text.startswith('//*')):
+                doc.append(text)
+        elif state == 'OUTSIDE':
+            state = 'HEADER'
+            header_start = m.start()
+            depth = 0
+        elif state == 'HEADER':
+            if text == '(':
+                depth += 1
+            elif text == ')':
+                depth -= 1
+            elif depth == 0:
+                state = 'BODY'
+                doc.append(buf[header_start:pos])
+                header_start = None
+        else:
+            state = 'OUTSIDE'
+            result = interpret_module_text(doc, skip_errors)
+            if result is not None:
+                yield result
+            doc = []
+    if state == 'BODY':
+        # missing endmodule
+        result = interpret_module_text(doc, skip_errors)
+        if result is not None:
+            yield result
+
+class Record(object):
+    # legacy dict-style access on top of the named fields, so that
+    # module['input_ports'][0]['packed0'] keeps working
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if not isinstance(key, str):
+            return tuple.__getitem__(self, key)
+        if key in self._fields:
+            return getattr(self, key)
+        return self.as_dict()[key]
+
+    def keys(self):
+        return self.as_dict().keys()
+
+class Parameter(Record, namedtuple('Parameter', ('name', 'value'))):
+    __slots__ = ()
+
+    def as_dict(self):
+        return OrderedDict([ ('name', self.name), ('value', self.value) ])
+
+class Port(Record, namedtuple('Port', ('name', 'direction', 'type', 'sign', 'packed', 'unpacked'))):
+    # packed is a tuple of packed dimensions, outermost first
+    __slots__ = ()
+
+    def as_dict(self):
+        d = OrderedDict([ ('name', self.name), ('type', self.type), ('sign', self.sign) ])
+        for i in range(max(len(self.packed), 4)):
+            d['packed%d' % i] = self.packed[i] if i < len(self.packed) else ''
+        d['unpacked'] = self.unpacked
+        return d
+
+class InterfacePort(Record, namedtuple('InterfacePort', ('name', 'interface', 'modport', 'unpacked'))):
+    __slots__ = ()
+
+    def as_dict(self):
+        return OrderedDict([ ('name', self.name), ('interface', self.interface), ('modport', self.modport), ('unpacked', self.unpacked) ])
+
+class ModuleHeader(Record, namedtuple('ModuleHeader', ('name', 'parameters', 'input_ports', 'output_ports', 'inout_ports', 'interfaces', 'incoming_interfaces', 'outgoing_interfaces'))):
+    __slots__ = ()
+
+    def as_dict(self):
+        d = OrderedDict([ ('name', self.name) ])
+        for f in self._fields[1:]:
+            d[f] = [ p.as_dict() for p in getattr(self, f) ]
+        return d
+
+# one of the packed ranges of a PORT_DECL, already checked by the grammar
+PACKED_RANGE = re.compile(r'\[[^\]]*\]')
 
 def interpret_systemverilog(tokens):
-    module = OrderedDict([])
+    if STATS is not None:
+        t0 = time.perf_counter()
+    name = None
+    parameters = []
+    ports = { 'input' : [], 'output' : [], 'inout' : [] }
+    interfaces = []
+    incoming_interfaces = []
+    outgoing_interfaces = []
+    # a port without a direction takes the one of the previous port, and a
+    # bare name also takes its type or its interface (as in IEEE 1800)
+    previous = None
     # much easier than a real parsing!!!
     for t in tokens:
-        if t['token_type'] == 'MODULE_NAME':
-            module['name'] = t['name']
-            module['parameters'] = []
-            module['input_ports'] = []
-            module['output_ports'] = []
-            module['inout_ports'] = []
-            module['interfaces'] = []
-            module['incoming_interfaces'] = []
-            module['outgoing_interfaces'] = []
-        elif t['token_type'] == 'PARAMETER_DECL':
-            p = OrderedDict([])
-            p['name'] = t['name']
-            p['value'] = t['value']
-            module['parameters'].append(p)
-        elif t['token_type'] == 'PORT_DECL':
-            p = OrderedDict([])
-            p['name'] = t['name']
-            p['type'] = t['type']
-            p['sign'] = t['sign']
-            p['packed0'] = t['packed0'] if t['packed0'] is not None else ''
-            p['packed1'] = t['packed1'] if t['packed1'] is not None else ''
-            p['packed2'] = t['packed2'] if t['packed2'] is not None else ''
-            p['packed3'] = t['packed3'] if t['packed3'] is not None else ''
-            p['unpacked'] = t['unpacked'] if t['unpacked'] is not None else ''
-            module['%s_ports' % t['direction']].append(p)
-        elif t['token_type'] == 'PORT_DECL_INTF':
-            p = OrderedDict([])
-            p['name'] = t['name']
-            p['interface'] = t['interface']
-            p['modport'] = t['modport']
-            p['unpacked'] = t['unpacked'] if t['unpacked'] is not None else ''
-            if p['modport'] in INTERFACES_INCOMING_MODPORTS:
-                module['incoming_interfaces'].append(p)
-            elif p['modport'] in INTERFACES_OUTGOING_MODPORTS:
-                module['outgoing_interfaces'].append(p)
+        token_type = t['token_type']
+        if token_type == 'MODULE_NAME':
+            name = t['name']
+        elif token_type == 'PARAMETER_DECL':
+            parameters.append(Parameter(t['name'], t['value']))
+        elif token_type in ('PORT_DECL', 'PORT_DECL_INTF'):
+            unpacked = t['unpacked'] if t['unpacked'] is not None else ''
+            if token_type == 'PORT_DECL_INTF':
+                p = InterfacePort(t['name'], t['interface'], t['modport'], unpacked)
+            elif t['direction'] is None and t['type'] is None and t['sign'] is None and t['packed'] is None and previous is not None:
+                p = previous._replace(name=t['name'], unpacked=unpacked)
+            else:
+                packed = tuple(PACKED_RANGE.findall(t['packed'])) if t['packed'] is not None else ()
+                direction = t['direction']
+                if direction is None:
+                    if not isinstance(previous, Port):
+                        raise ParseError("port %s has no direction (only ANSI port lists are supported)" % t['name'], token=token_type, pos=t['start'])
+                    direction = previous.direction
+                p = Port(t['name'], direction, t['type'], t['sign'], packed, unpacked)
+            previous = p
+            if isinstance(p, Port):
+                ports[p.direction].append(p)
+            elif p.modport in INTERFACES_INCOMING_MODPORTS:
+                incoming_interfaces.append(p)
+            elif p.modport in INTERFACES_OUTGOING_MODPORTS:
+                outgoing_interfaces.append(p)
             else:
-                module['interfaces'].append(p)
+                interfaces.append(p)
+    module = ModuleHeader(name, parameters, ports['input'], ports['output'], ports['inout'], interfaces, incoming_interfaces, outgoing_interfaces)
+    if STATS is not None:
+        STATS.time('interpret', time.perf_counter()-t0)
     return module
 
 DEFAULT_FONT = "Helvetica Neue"
@@ -193,7 +571,8 @@ INTERFACE_MAP = {
 }
 
 def write_nodes(module, port_list_name, shorthand_prefix, set_name=None, kind='port', direction='in', font_face=DEFAULT_FONT):
-    if len(module[port_list_name])==0:
+    ports = getattr(module, port_list_name)
+    if len(ports)==0:
         return ''
     if set_name is None:
         set_name = port_list_name
@@ -201,175 +580,496 @@ def write_nodes(module, port_list_name, shorthand_prefix, set_name=None, kind='p
         align = "RIGHT"
     else:
         align = "LEFT"
-    s = ''
+    s = []
     if kind == 'port':
-        for i in range(len(module[port_list_name])):
-            tp = module[port_list_name][i]['type']
+        for i in range(len(ports)):
+            tp = ports[i].type
             tp = ' ' if tp in ('logic', 'wire', 'reg') else tp
-            s += '<TR><TD PORT="%s%d" ALIGN="%s"><FONT FACE="%s Bold">%s</FONT> %s</TD></TR>' % (shorthand_prefix, i, align, font_face, tp, module[port_list_name][i]['name'])
+            s.append('<TR><TD PORT="%s%d" ALIGN="%s"><FONT FACE="%s Bold">%s</FONT> %s</TD></TR>' % (shorthand_prefix, i, align, font_face, tp, ports[i].name))
     else:
-        for i in range(len(module[port_list_name])):
+        for i in range(len(ports)):
             try:
-                intf_name = INTERFACE_MAP[module[port_list_name][i]['interface']]
+                intf_name = INTERFACE_MAP[ports[i].interface]
             except KeyError:
-                intf_name = module[port_list_name][i]['interface']
-            s += '<TR><TD PORT="%s%d" ALIGN="%s"><FONT FACE="%s Bold">%s</FONT> %s</TD></TR>' % (shorthand_prefix, i, align, font_face, intf_name, module[port_list_name][i]['name'])
-    return s
+                intf_name = ports[i].interface
+            s.append('<TR><TD PORT="%s%d" ALIGN="%s"><FONT FACE="%s Bold">%s</FONT> %s</TD></TR>' % (shorthand_prefix, i, align, font_face, intf_name, ports[i].name))
+    return ''.join(s)
 
 def add_edges(graph, module, port_list_name, shorthand_prefix, set_name=None, kind='port', direction='in', font_face=DEFAULT_FONT):
-    if len(module[port_list_name])==0:
+    import pydotplus
+    ports = getattr(module, port_list_name)
+    if len(ports)==0:
         return
     if set_name is None:
         set_name = port_list_name
     if kind == 'port':
         if direction == 'in':
-            for i in range(len(module[port_list_name])):
-                label = module[port_list_name][i]['unpacked']+module[port_list_name][i]['packed0']+module[port_list_name][i]['packed1']+module[port_list_name][i]['packed2']+module[port_list_name][i]['packed3']
-                graph.add_edge(pydotplus.graphviz.Edge(('%s:%s%d' % (set_name, shorthand_prefix, i), module['name']+':%s%d' % (shorthand_prefix, i)), label=label, fontsize=10, fontname=font_face, arrowhead='tee'))
+            for i in range(len(ports)):
+                label = ports[i].unpacked+''.join(ports[i].packed)
+                graph.add_edge(pydotplus.graphviz.Edge(('%s:%s%d' % (set_name, shorthand_prefix, i), module.name+':%s%d' % (shorthand_prefix, i)), label=label, fontsize=10, fontname=font_face, arrowhead='tee'))
         else:
-            for i in range(len(module[port_list_name])):
-                label = module[port_list_name][i]['unpacked']+module[port_list_name][i]['packed0']+module[port_list_name][i]['packed1']+module[port_list_name][i]['packed2']+module[port_list_name][i]['packed3']
-                graph.add_edge(pydotplus.graphviz.Edge((module['name']+':%s%d' % (shorthand_prefix, i), '%s:%s%d' % (set_name, shorthand_prefix, i)), label=label, fontsize=10, fontname=font_face, arrowtail='tee', dir='back'))
+            for i in range(len(ports)):
+                label = ports[i].unpacked+''.join(ports[i].packed)
+                graph.add_edge(pydotplus.graphviz.Edge((module.name+':%s%d' % (shorthand_prefix, i), '%s:%s%d' % (set_name, shorthand_prefix, i)), label=label, fontsize=10, fontname=font_face, arrowtail='tee', dir='back'))
     else:
         if direction == 'in':
-            for i in range(len(module[port_list_name])):
-                label = module[port_list_name][i]['unpacked']
-                graph.add_edge(pydotplus.graphviz.Edge(('%s:%s%d' % (set_name, shorthand_prefix, i), module['name']+':%s%d' % (shorthand_prefix, i)), label=label, fontsize=10, fontname=font_face, penwidth=3))
+            for i in range(len(ports)):
+                label = ports[i].unpacked
+                graph.add_edge(pydotplus.graphviz.Edge(('%s:%s%d' % (set_name, shorthand_prefix, i), module.name+':%s%d' % (shorthand_prefix, i)), label=label, fontsize=10, fontname=font_face, penwidth=3))
         else:
-            for i in range(len(module[port_list_name])):
-                label = module[port_list_name][i]['unpacked']
-                graph.add_edge(pydotplus.graphviz.Edge((module['name']+':%s%d' % (shorthand_prefix, i), '%s:%s%d' % (set_name, shorthand_prefix, i)), label=label, fontsize=10, fontname=font_face, penwidth=3))
+            for i in range(len(ports)):
+                label = ports[i].unpacked
+                graph.add_edge(pydotplus.graphviz.Edge((module.name+':%s%d' % (shorthand_prefix, i), '%s:%s%d' % (set_name, shorthand_prefix, i)), label=label, fontsize=10, fontname=font_face, penwidth=3))
 
-def sv_prettyplot(path, genimg_path, gendot=True, always_coprime=True, cellspacing_block=10, cellspacing_wires=10):
-    with open(path, "r") as f:
-        code = f.read()
+IMG_FORMATS = ('dot', 'svg', 'pdf', 'png')
+DEFAULT_IMG_FORMATS = ('dot', 'pdf', 'png')
 
-    tokens, comments = tokenize_systemverilog(code)
-    module = interpret_systemverilog(tokens)
+class GraphvizError(Exception):
+    pass
 
-    from math import gcd as bltin_gcd
+def find_dot():
+    global DOT_PATH
+    if DOT_PATH is None:
+        DOT_PATH = shutil.which('dot')
+        if DOT_PATH is None:
+            raise GraphvizError("Graphviz 'dot' executable not found in PATH")
+    return DOT_PATH
 
-    def coprime2(a, b):
-        if a == 1 or b == 1:
-            return False
-        return bltin_gcd(a, b) == 1
+DOT_PATH = None
 
-    graph = pydotplus.graphviz.Dot('module', graph_type='digraph', rankdir='LR')
-    s =  '<<TABLE BORDER="1" CELLBORDER="0" CELLSPACING="%d">' % cellspacing_block
-    # title
-    s += '<TR><TD PORT="t" COLSPAN="2"><FONT FACE="Helvetica Neue Bold">%s</FONT></TD></TR>\n' % (module['name'])
-    # all rows
+def render_dot(dot, genimg_path, formats=DEFAULT_IMG_FORMATS):
+    # lay out the graph once and emit all requested formats from the same
+    # Graphviz run (one -T/-o pair per format)
+    if 'dot' in formats:
+        with open(genimg_path+".dot", "w") as f:
+            f.write(dot)
+        if STATS is not None:
+            STATS.count('output_bytes', len(dot))
+    cmd = [ find_dot() ]
+    for fmt in formats:
+        if fmt != 'dot':
+            cmd += [ '-T%s' % fmt, '-o%s.%s' % (genimg_path, fmt) ]
+    if len(cmd) == 1:
+        return
+    stats = STATS
+    if stats is not None:
+        t0 = time.perf_counter()
+    p = subprocess.run(cmd, input=dot.encode('utf-8'), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if p.returncode != 0:
+        raise GraphvizError("dot exited with code %d: %s" % (p.returncode, p.stderr.decode('utf-8', 'replace')))
+    if stats is not None:
+        stats.time('graphviz', time.perf_counter()-t0)
+        stats.count('graphviz_runs')
+        stats.count('output_bytes', sum(os.path.getsize('%s.%s' % (genimg_path, fmt)) for fmt in formats if fmt != 'dot'))
+
+def img_formats(formats=None, gendot=True):
+    if formats is None:
+        formats = DEFAULT_IMG_FORMATS
+    for fmt in formats:
+        if fmt not in IMG_FORMATS:
+            raise ValueError("unsupported format %r, expected a subset of %s" % (fmt, ', '.join(IMG_FORMATS)))
+    if not gendot:
+        formats = tuple(fmt for fmt in formats if fmt != 'dot')
+    return tuple(formats)
+
+def parse_systemverilog(code, module=None, path=None):
+    # (module, comments) for the first module in code, or the one called module
+    if module is None:
+        tokens, comments = tokenize_systemverilog(code)
+        return interpret_systemverilog(tokens), comments
+    for header, comments in iter_modules(io.StringIO(code)):
+        if header.name == module:
+            return header, comments
+    raise ParseError("module %s not found in %s" % (module, path or 'code'))
+
+def sv_prettyplot(path, genimg_path, gendot=True, always_coprime=True, cellspacing_block=10, cellspacing_wires=10, font_face=DEFAULT_FONT, cache=None, formats=None, module=None, backend='graphviz', preprocess=None):
+    # plot the first module in path, or the one called module; preprocess is
+    # an optional preprocess.Preprocessor
+    formats = img_formats(formats, gendot)
+    suffixes = tuple('.'+fmt for fmt in formats)
+
+    stats = STATS
+    if stats is not None:
+        stats.begin(path if module is None else '%s:%s' % (path, module))
+    try:
+        with open(path, "r") as f:
+            code = f.read()
+        constants = None
+        if preprocess is not None:
+            code, constants = preprocess.run(code, path)
+
+        # look up the rendered diagram in the cache (a cache.RenderCache)
+        if cache is not None:
+            key = cache.key(code, always_coprime=always_coprime, cellspacing_block=cellspacing_block, cellspacing_wires=cellspacing_wires, font_face=font_face, suffixes=suffixes, module=module, backend=backend, constants=constants and sorted(constants.items()))
+            comments = cache.fetch(key, genimg_path, suffixes)
+            if stats is not None:
+                stats.count('cache_misses' if comments is None else 'cache_hits')
+            if comments is not None:
+                return comments
+
+        module, comments = parse_systemverilog(code, module, path)
+        if preprocess is not None:
+            module = preprocess.resolve(module, constants)
+
+        render_module(module, genimg_path, formats, always_coprime=always_coprime, cellspacing_block=cellspacing_block, cellspacing_wires=cellspacing_wires, font_face=font_face, backend=backend)
+
+        if cache is not None:
+            cache.store(key, genimg_path, suffixes, comments)
+
+        return comments
+    finally:
+        if stats is not None:
+            stats.end()
+
+def sv_prettyplot_modules(path, genimg_path, names=None, gendot=True, always_coprime=True, cellspacing_block=10, cellspacing_wires=10, font_face=DEFAULT_FONT, cache=None, formats=None, backend='graphviz', preprocess=None):
+    # plot every module in path (or those in names) to genimg_path_<name>;
+    # returns an OrderedDict of module name -> comments
+    formats = img_formats(formats, gendot)
+    suffixes = tuple('.'+fmt for fmt in formats)
+    stats = STATS
+    if stats is not None:
+        stats.begin(path)
+    try:
+        results = OrderedDict([])
+        source = path
+        if preprocess is not None:
+            with open(path, "r") as f:
+                code, constants = preprocess.run(f.read(), path)
+            source = io.StringIO(code)
+        for module, comments in iter_modules(source):
+            if names is not None and module.name not in names:
+                continue
+            if preprocess is not None:
+                module = preprocess.resolve(module, constants)
+            module_genimg_path = '%s_%s' % (genimg_path, module.name)
+            results[module.name] = comments
+            # the cache is keyed on the interpreted header here
+            if cache is not None:
+                key = cache.key(repr((module, comments)), always_coprime=always_coprime, cellspacing_block=cellspacing_block, cellspacing_wires=cellspacing_wires, font_face=font_face, suffixes=suffixes, backend=backend)
+                hit = cache.fetch(key, module_genimg_path, suffixes) is not None
+                if stats is not None:
+                    stats.count('cache_hits' if hit else 'cache_misses')
+                if hit:
+                    continue
+            render_module(module, module_genimg_path, formats, always_coprime=always_coprime, cellspacing_block=cellspacing_block, cellspacing_wires=cellspacing_wires, font_face=font_face, backend=backend)
+            if cache is not None:
+                cache.store(key, module_genimg_path, suffixes, comments)
+        return results
+    finally:
+        if stats is not None:
+            stats.end()
+
+BACKENDS = ('graphviz', 'native')
+
+def render_module(module, genimg_path, formats=DEFAULT_IMG_FORMATS, always_coprime=True, cellspacing_block=10, cellspacing_wires=10, font_face=DEFAULT_FONT, backend='graphviz'):
+    if backend not in BACKENDS:
+        raise ValueError("unsupported backend %r, expected one of %s" % (backend, ', '.join(BACKENDS)))
+    # render next to the outputs and only replace them once every format
+    # succeeded: a failed re-render keeps the last good outputs, and the old
+    # files (which may be hard-linked into the cache) are never written through
+    tmp_path = '%s.tmp%d' % (genimg_path, os.getpid())
+    suffixes = tuple('.'+fmt for fmt in formats)
+    try:
+        render_module_to(module, tmp_path, formats, always_coprime, cellspacing_block, cellspacing_wires, font_face, backend)
+        for suffix in suffixes:
+            os.replace(tmp_path+suffix, genimg_path+suffix)
+    finally:
+        for suffix in suffixes:
+            try:
+                os.remove(tmp_path+suffix)
+            except FileNotFoundError:
+                pass
+
+def render_module_to(module, genimg_path, formats, always_coprime, cellspacing_block, cellspacing_wires, font_face, backend):
+    if backend == 'native' and 'svg' in formats:
+        # SVG straight from the parsed module; any other format still goes
+        # through Graphviz
+        from svprettyplot.svg import render_svg
+        if STATS is not None:
+            t0 = time.perf_counter()
+        render_svg(module, genimg_path, always_coprime=always_coprime, cellspacing_block=cellspacing_block, cellspacing_wires=cellspacing_wires, font_face=font_face)
+        if STATS is not None:
+            STATS.time('svg', time.perf_counter()-t0)
+            STATS.count('output_bytes', os.path.getsize(genimg_path+".svg"))
+        formats = tuple(fmt for fmt in formats if fmt != 'svg')
+        if len(formats) == 0:
+            return
+
+    if STATS is not None:
+        t0 = time.perf_counter()
+    dot = module_dot(module, always_coprime=always_coprime, cellspacing_block=cellspacing_block, cellspacing_wires=cellspacing_wires, font_face=font_face)
+    if STATS is not None:
+        STATS.time('dot_emission', time.perf_counter()-t0)
+
+    render_dot(dot, genimg_path, formats)
+
+def stacked_rows(left, right):
+    # one row per port of the longer side, both sides stacked from the top;
+    # left and right are lists of (port, name) cells, rows are lists of
+    # (rowspan, port, name) cells
+    rows = []
+    for i in range(max(len(left), len(right))):
+        row = []
+        if i < len(left):
+            row.append((1, ) + left[i])
+        if i < len(right):
+            row.append((1, ) + right[i])
+        rows.append(row)
+    return rows
+
+def spread_rows(left, right):
+    # both sides spread evenly over the same height: the row boundaries are
+    # the union of the left and right cell boundaries (scaled by
+    # n_left*n_right), so there are n_left+n_right-gcd rows instead of the
+    # n_left*n_right of a uniform grid; the left cells are placed first so
+    # they come first in their rows
+    n_left, n_right = len(left), len(right)
+    sides = [ (cells, max(n_left, 1)*max(n_right, 1)//len(cells)) for cells in (left, right) if len(cells) > 0 ]
+    boundaries = sorted(set(k*step for cells, step in sides for k in range(len(cells)+1)))
+    row_of = { b : i for i, b in enumerate(boundaries) }
+    rows = [ [] for i in range(len(boundaries)-1) ]
+    for cells, step in sides:
+        for k, cell in enumerate(cells):
+            start = row_of[k*step]
+            rows[start].append((row_of[(k+1)*step]-start, ) + cell)
+    return rows
+
+def block_label(module, always_coprime=True, cellspacing_block=10, font_face=DEFAULT_FONT):
+    # HTML label of the module block: its title and one invisible cell per
+    # wire, which the edges point to
+    inputs  = [ ('i%d'  % i, p.name) for i, p in enumerate(module.input_ports) ]
+    incoming = [ ('ii%d' % i, p.name) for i, p in enumerate(module.incoming_interfaces) ]
+    outputs = [ ('o%d'  % i, p.name) for i, p in enumerate(module.output_ports) ]
+    outgoing = [ ('io%d' % i, p.name) for i, p in enumerate(module.outgoing_interfaces) ]
     if always_coprime:
-        n_in  = max(len(module['input_ports']) +len(module['incoming_interfaces']), 1)
-        n_out = max(len(module['output_ports'])+len(module['outgoing_interfaces']), 1)
-        coprime = coprime2(n_in, n_out) or always_coprime
-        nb_ports = max(n_in, n_out) if coprime else n_in * n_out
-        if len(module['input_ports'])+len(module['incoming_interfaces'])>0 or len(module['output_ports'])+len(module['outgoing_interfaces'])>0:
-            for i in range(0, nb_ports):
-                i_out_cond = i<n_in  if coprime else i%n_out==0
-                i_in_cond  = i<n_out if coprime else i%n_in==0
-                i_out = i if coprime else i//n_out
-                i_in  = i if coprime else i//n_in
-                rs_out = 1 if i<n_in  else nb_ports-n_out+1 if coprime else n_out
-                rs_in  = 1 if i<n_out else nb_ports-n_in +1 if coprime else n_in
-                s += '<TR>\n'
-                if i_out_cond:
-                    if i_out < len(module['input_ports']):
-                        s += '<TD ROWSPAN="%d" PORT="i%d"><FONT COLOR="white">%s</FONT></TD>\n' % (rs_out, i_out, module['input_ports'][i_out]['name'])
-                    elif i_out < len(module['input_ports'])+len(module['incoming_interfaces']):
-                        s += '<TD ROWSPAN="%d" PORT="ii%d"><FONT COLOR="white">%s</FONT></TD>\n' % (rs_out, i_out-len(module['input_ports']), module['incoming_interfaces'][i_out-len(module['input_ports'])]['name'])
-                if i_in_cond:
-                    if i_in < len(module['output_ports']):
-                        s += '<TD ROWSPAN="%d" PORT="o%d"><FONT COLOR="white">%s</FONT></TD>\n' % (rs_in, i_in, module['output_ports'][i_in]['name'])
-                    elif i_in < len(module['output_ports'])+len(module['outgoing_interfaces']):
-                        s += '<TD ROWSPAN="%d" PORT="io%d"><FONT COLOR="white">%s</FONT></TD>\n' % (rs_in, i_in-len(module['output_ports']), module['outgoing_interfaces'][i_in-len(module['output_ports'])]['name'])
-                s += '</TR>\n'
+        rows = stacked_rows(inputs+incoming, outputs+outgoing)
     else:
-        # port rows
-        n_in  = max(len(module['input_ports']) +len(module['incoming_interfaces']), 1)
-        n_out = max(len(module['output_ports'])+len(module['outgoing_interfaces']), 1)
-        coprime = coprime2(n_in, n_out) or always_coprime
-        nb_ports = max(n_in, n_out) if coprime else n_in * n_out
-        if len(module['input_ports'])>0 or len(module['output_ports'])>0:
-            for i in range(0, nb_ports):
-                i_out_cond = i<n_in  if coprime else i%n_out==0
-                i_in_cond  = i<n_out if coprime else i%n_in==0
-                i_out = i if coprime else i//n_out
-                i_in  = i if coprime else i//n_in
-                rs_out = 1 if i<n_in  else nb_ports-n_out+1 if coprime else n_out
-                rs_in  = 1 if i<n_out else nb_ports-n_in +1 if coprime else n_in
-                s += '<TR>\n'
-                if i_out_cond:
-                    if i_out < len(module['input_ports']):
-                        s += '<TD ROWSPAN="%d" PORT="i%d"><FONT COLOR="white">%s</FONT></TD>\n' % (rs_out, i_out, module['input_ports'][i_out]['name'])
-                if i_in_cond:
-                    if i_in < len(module['output_ports']):
-                        s += '<TD ROWSPAN="%d" PORT="o%d"><FONT COLOR="white">%s</FONT></TD>\n' % (rs_in, i_in, module['output_ports'][i_in]['name'])
-                s += '</TR>\n'
-        # interface rows (incoming, outgoing)
-        n_in  = max(len(module['incoming_interfaces']), 1)
-        n_out = max(len(module['outgoing_interfaces']), 1)
-        coprime = coprime2(n_in, n_out) or always_coprime
-        nb_ports = max(n_in, n_out) if coprime else n_in * n_out
-        if len(module['incoming_interfaces'])>0 or len(module['outgoing_interfaces'])>0:
-            for i in range(0, nb_ports):
-                i_out_cond = i<n_in  if coprime else i%n_out==0
-                i_in_cond  = i<n_out if coprime else i%n_in==0
-                i_out = i if coprime else i//n_out
-                i_in  = i if coprime else i//n_in
-                rs_out = 1 if i<n_in  else nb_ports-n_out+1 if coprime else n_out
-                rs_in  = 1 if i<n_out else nb_ports-n_in +1 if coprime else n_in
-                s += '<TR>\n'
-                if i_out_cond:
-                    if i_out < len(module['incoming_interfaces']):
-                        s += '<TD ROWSPAN="%d" PORT="ii%d"><FONT COLOR="white">%s</FONT></TD>\n' % (rs_out, i_out, module['incoming_interfaces'][i_out]['name'])
-                if i_in_cond:
-                    if i_in < len(module['outgoing_interfaces']):
-                        s += '<TD ROWSPAN="%d" PORT="io%d"><FONT COLOR="white">%s</FONT></TD>\n' % (rs_in, i_in, module['outgoing_interfaces'][i_in]['name'])
-                s += '</TR>\n'
+        # ports, then interfaces, each spread over its own block of rows
+        rows = spread_rows(inputs, outputs) + spread_rows(incoming, outgoing)
     # interface rows -- the rest
-    n = len(module['interfaces'])
-    for i in range(0, n):
-        s += '<TR>\n'
-        s += '<TD ROWSPAN="1" PORT="iri%d"><FONT COLOR="white">%s</FONT></TD>\n' % (i, module['interfaces'][i]['name'])
-        s += '<TD ROWSPAN="1" PORT="iro%d"><FONT COLOR="white">%s</FONT></TD>\n' % (i, module['interfaces'][i]['name'])
-        s += '</TR>\n'
-    s += '</TABLE>>'
-    graph.add_node(pydotplus.graphviz.Node(module['name'], label=s, shape='none', fontname='Helvetica Neue'))
-
-
-    s =  '<<TABLE BORDER="0" CELLBORDER="0" CELLSPACING="%d">\n' % cellspacing_wires
-    s += write_nodes(module, 'input_ports', 'i', direction='in', set_name='inputs')
-    s += write_nodes(module, 'incoming_interfaces', 'ii', kind='interface', direction='in', set_name='inputs')
-    # s += write_nodes(module, 'interfaces', 'iri', set_name='incoming_rest_interfaces', kind='interface', direction='in', set_name='inputs')
-    s += '</TABLE>>'
-    graph.add_node(pydotplus.graphviz.Node('inputs', label=s, shape='none', fontname=DEFAULT_FONT, labeljust='r'))
-
-    s =  '<<TABLE BORDER="0" CELLBORDER="0" CELLSPACING="%d">\n' % cellspacing_wires
-    s += write_nodes(module, 'output_ports', 'o', direction='out', set_name='outputs')
-    s += write_nodes(module, 'outgoing_interfaces', 'io', kind='interface', direction='out', set_name='outputs')
-    # s += write_nodes(module, 'interfaces', 'iro', set_name='outgoing_rest_interfaces', kind='interface', direction='out', set_name='outputs')
-    s += '</TABLE>>'
-    graph.add_node(pydotplus.graphviz.Node('outputs', label=s, shape='none', fontname=DEFAULT_FONT, labeljust='l'))
-
-    add_edges(graph, module, 'input_ports', 'i', direction='in', set_name='inputs')
-    add_edges(graph, module, 'incoming_interfaces', 'ii', kind='interface', direction='in', set_name='inputs')
-    add_edges(graph, module, 'output_ports', 'o', direction='out', set_name='outputs')
-    add_edges(graph, module, 'outgoing_interfaces', 'io', kind='interface', direction='out', set_name='outputs')
-
-    # if gendot:
-    graph.write(genimg_path+".dot")
-
-    with open(genimg_path+".pdf", "wb") as f:
-        f.write(graph.create_pdf())
-
-    with open(genimg_path+".png", "wb") as f:
-        f.write(graph.create_png())
-
-    return comments
+    for i, p in enumerate(module.interfaces):
+        rows.append([ (1, 'iri%d' % i, p.name), (1, 'iro%d' % i, p.name) ])
+
+    s = [ '<<TABLE BORDER="1" CELLBORDER="0" CELLSPACING="%d">' % cellspacing_block ]
+    # title
+    s.append('<TR><TD PORT="t" COLSPAN="2"><FONT FACE="%s Bold">%s</FONT></TD></TR>\n' % (font_face, module.name))
+    for row in rows:
+        s.append('<TR>\n')
+        for cell in row:
+            s.append('<TD ROWSPAN="%d" PORT="%s"><FONT COLOR="white">%s</FONT></TD>\n' % cell)
+        s.append('</TR>\n')
+    s.append('</TABLE>>')
+    return ''.join(s)
+
+def wires_label(module, direction='in', cellspacing_wires=10, font_face=DEFAULT_FONT):
+    # HTML label of the inputs or outputs column
+    s = [ '<<TABLE BORDER="0" CELLBORDER="0" CELLSPACING="%d">\n' % cellspacing_wires ]
+    if direction == 'in':
+        s.append(write_nodes(module, 'input_ports', 'i', direction='in', set_name='inputs', font_face=font_face))
+        s.append(write_nodes(module, 'incoming_interfaces', 'ii', kind='interface', direction='in', set_name='inputs', font_face=font_face))
+    else:
+        s.append(write_nodes(module, 'output_ports', 'o', direction='out', set_name='outputs', font_face=font_face))
+        s.append(write_nodes(module, 'outgoing_interfaces', 'io', kind='interface', direction='out', set_name='outputs', font_face=font_face))
+    s.append('</TABLE>>')
+    return ''.join(s)
+
+def module_graph(module, always_coprime=True, cellspacing_block=10, cellspacing_wires=10, font_face=DEFAULT_FONT):
+    # the diagram as a pydotplus graph, for callers that want to edit it;
+    # rendering goes through write_dot, which does not need pydotplus
+    import pydotplus
+    graph = pydotplus.graphviz.Dot('module', graph_type='digraph', rankdir='LR')
+    graph.add_node(pydotplus.graphviz.Node(module.name, label=block_label(module, always_coprime, cellspacing_block, font_face), shape='none', fontname=font_face))
+    graph.add_node(pydotplus.graphviz.Node('inputs', label=wires_label(module, 'in', cellspacing_wires, font_face), shape='none', fontname=font_face, labeljust='r'))
+    graph.add_node(pydotplus.graphviz.Node('outputs', label=wires_label(module, 'out', cellspacing_wires, font_face), shape='none', fontname=font_face, labeljust='l'))
+    add_edges(graph, module, 'input_ports', 'i', direction='in', set_name='inputs', font_face=font_face)
+    add_edges(graph, module, 'incoming_interfaces', 'ii', kind='interface', direction='in', set_name='inputs', font_face=font_face)
+    add_edges(graph, module, 'output_ports', 'o', direction='out', set_name='outputs', font_face=font_face)
+    add_edges(graph, module, 'outgoing_interfaces', 'io', kind='interface', direction='out', set_name='outputs', font_face=font_face)
+    return graph
+
+DOT_ID = re.compile(r'(?:[_a-zA-Z][a-zA-Z0-9_]*|[0-9]+|<.*>)\Z', re.DOTALL)
+DOT_KEYWORDS = ( 'graph', 'subgraph', 'digraph', 'node', 'edge', 'strict' )
+
+def dot_quote(s):
+    # s as a DOT ID: plain identifiers, numbers and HTML labels as they are,
+    # anything else double-quoted
+    if DOT_ID.match(s) and s.lower() not in DOT_KEYWORDS:
+        return s
+    return '"%s"' % s.replace('"', r'\"').replace('\n', r'\n').replace('\r', r'\r')
+
+def write_edges(out, module, port_list_name, shorthand_prefix, set_name=None, kind='port', direction='in', font_face=DEFAULT_FONT):
+    # one edge per wire, written to out in the same form as add_edges
+    ports = getattr(module, port_list_name)
+    if set_name is None:
+        set_name = port_list_name
+    name = dot_quote(module.name)
+    font = dot_quote(font_face)
+    for i, p in enumerate(ports):
+        wire = '%s:%s%d' % (set_name, shorthand_prefix, i)
+        block = '%s:%s%d' % (name, shorthand_prefix, i)
+        if kind == 'port':
+            label = dot_quote(p.unpacked+''.join(p.packed))
+            if direction == 'in':
+                out.write('%s -> %s  [arrowhead=tee, fontname=%s, fontsize=10, label=%s];\n' % (wire, block, font, label))
+            else:
+                out.write('%s -> %s  [arrowtail=tee, dir=back, fontname=%s, fontsize=10, label=%s];\n' % (block, wire, font, label))
+        else:
+            label = dot_quote(p.unpacked)
+            if direction == 'in':
+                out.write('%s -> %s  [fontname=%s, fontsize=10, label=%s, penwidth=3];\n' % (wire, block, font, label))
+            else:
+                out.write('%s -> %s  [fontname=%s, fontsize=10, label=%s, penwidth=3];\n' % (block, wire, font, label))
+
+def write_dot(module, out, always_coprime=True, cellspacing_block=10, cellspacing_wires=10, font_face=DEFAULT_FONT):
+    # stream the DOT text of the diagram to out (a text file or buffer)
+    font = dot_quote(font_face)
+    out.write('digraph module {\nrankdir=LR;\n')
+    out.write('%s [fontname=%s, label=%s, shape=none];\n' % (dot_quote(module.name), font, block_label(module, always_coprime, cellspacing_block, font_face)))
+    out.write('inputs [fontname=%s, label=%s, labeljust=r, shape=none];\n' % (font, wires_label(module, 'in', cellspacing_wires, font_face)))
+    out.write('outputs [fontname=%s, label=%s, labeljust=l, shape=none];\n' % (font, wires_label(module, 'out', cellspacing_wires, font_face)))
+    write_edges(out, module, 'input_ports', 'i', direction='in', set_name='inputs', font_face=font_face)
+    write_edges(out, module, 'incoming_interfaces', 'ii', kind='interface', direction='in', set_name='inputs', font_face=font_face)
+    write_edges(out, module, 'output_ports', 'o', direction='out', set_name='outputs', font_face=font_face)
+    write_edges(out, module, 'outgoing_interfaces', 'io', kind='interface', direction='out', set_name='outputs', font_face=font_face)
+    out.write('}\n')
+
+def module_dot(module, always_coprime=True, cellspacing_block=10, cellspacing_wires=10, font_face=DEFAULT_FONT):
+    out = io.StringIO()
+    write_dot(module, out, always_coprime=always_coprime, cellspacing_block=cellspacing_block, cellspacing_wires=cellspacing_wires, font_face=font_face)
+    return out.getvalue()
+
+def expand_paths(paths):
+    # files, directories (searched recursively) and globs of .sv files
+    expanded = []
+    for p in paths:
+        if os.path.isdir(p):
+            found = glob.glob(os.path.join(p, '**', '*.sv'), recursive=True)
+        elif glob.has_magic(p):
+            found = glob.glob(p, recursive=True)
+        else:
+            found = [ p ]
+        for f in sorted(found):
+            f = os.path.normpath(f)
+            if f not in expanded:
+                expanded.append(f)
+    return expanded
+
+def render_one(args):
+    path, genimg_path, kwargs = args
+    try:
+        sv_prettyplot(path, genimg_path, **kwargs)
+    except Exception as e:
+        # reported with its file, so that one bad file does not stop a batch
+        return path, genimg_path, '%s: %s' % (type(e).__name__, e)
+    return path, genimg_path, None
+
+def render_one_pooled(args):
+    # render_one in a worker process; also returns the cache hits and misses
+    # counted by its copy of the cache and, when with_stats, its stats
+    # records, which render_many adds to those of the parent process
+    work, with_stats = args
+    cache = work[2].get('cache')
+    counts = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    stats = enable_stats() if with_stats else None
+    try:
+        result = render_one(work)
+    finally:
+        if with_stats:
+            disable_stats()
+    if cache is not None:
+        counts = (cache.hits-counts[0], cache.misses-counts[1])
+    return result, counts, stats.files if stats is not None else None
+
+def sv_prettyplot_many(paths, out_dir, jobs=None, **kwargs):
+    # render many files on a process pool; returns a list of
+    # (path, genimg_path, error) tuples with error None on success
+    paths = expand_paths(paths)
+    work = [ (p, genimg_path, kwargs) for p, genimg_path in zip(paths, output_paths(paths, out_dir)) ]
+    for d in set(os.path.dirname(w[1]) for w in work) | { out_dir }:
+        os.makedirs(d, exist_ok=True)
+    return render_many(work, jobs)
+
+def output_paths(paths, out_dir):
+    # one output path per file, mirroring the tree below the deepest common
+    # directory of the files, so that files with the same name in different
+    # directories do not overwrite each other
+    if len(paths) == 0:
+        return []
+    paths = [ os.path.abspath(p) for p in paths ]
+    base = os.path.commonpath([ os.path.dirname(p) for p in paths ])
+    return [ os.path.join(out_dir, os.path.relpath(p, base)) for p in paths ]
+
+def render_many(work, jobs=None):
+    # run sv_prettyplot on a process pool for each (path, genimg_path, kwargs)
+    # in work; returns the (path, genimg_path, error) tuples in order
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if jobs <= 1 or len(work) <= 1:
+        return [ render_one(w) for w in work ]
+    import concurrent.futures
+    chunksize = max(1, len(work)//(4*jobs))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        # the workers have their own copies of the cache and stats, whose
+        # counts are merged back here
+        with_stats = STATS is not None
+        results = []
+        for w, (result, (hits, misses), files) in zip(work, pool.map(render_one_pooled, [ (w, with_stats) for w in work ], chunksize=chunksize)):
+            cache = w[2].get('cache')
+            if cache is not None:
+                cache.merge(hits, misses)
+            if files is not None:
+                STATS.merge(files)
+            results.append(result)
+        return results
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Plot SystemVerilog module headers with Graphviz.")
+    parser.add_argument('paths', nargs='+', help=".sv files, directories or globs")
+    parser.add_argument('-o', '--out-dir', default='genimg', help="output directory (default: genimg)")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="number of worker processes (default: all cores)")
+    parser.add_argument('-f', '--formats', default=','.join(DEFAULT_IMG_FORMATS), help="comma-separated subset of %s" % ','.join(IMG_FORMATS))
+    parser.add_argument('--cache-dir', default=None, help="reuse renders from this cache directory")
+    parser.add_argument('--no-coprime', action='store_true', help="do not force the coprime row layout")
+    parser.add_argument('--backend', choices=BACKENDS, default='graphviz', help="renderer for SVG output (default: graphviz)")
+    parser.add_argument('-I', '--include-dir', action='append', default=[], help="preprocess the files, looking for `include files in this directory")
+    parser.add_argument('-D', '--define', action='append', default=[], metavar='NAME[=VALUE]', help="preprocess the files with this macro defined")
+    parser.add_argument('--package', action='append', default=[], help="preprocess the files with the parameters of the packages in this file")
+    parser.add_argument('--stats', type=int, default=0, metavar='N', help="print per-stage times and counters, and the N slowest files")
+    args = parser.parse_args(argv)
+
+    formats = tuple(args.formats.split(','))
+    for fmt in formats:
+        if fmt not in IMG_FORMATS:
+            parser.error("unsupported format %r" % fmt)
+    kwargs = dict(formats=formats, always_coprime=not args.no_coprime, backend=args.backend)
+    if len(args.include_dir) > 0 or len(args.define) > 0 or len(args.package) > 0:
+        from svprettyplot.preprocess import Preprocessor
+        defines = dict((d.split('=', 1) + [ None ])[:2] for d in args.define)
+        kwargs['preprocess'] = Preprocessor(args.include_dir, defines, args.package)
+    if args.cache_dir is not None:
+        from svprettyplot.cache import RenderCache
+        kwargs['cache'] = RenderCache(args.cache_dir)
+    if args.stats > 0:
+        enable_stats()
+    results = sv_prettyplot_many(args.paths, args.out_dir, jobs=args.jobs, **kwargs)
+
+    nb_errors = 0
+    for path, genimg_path, error in results:
+        if error is None:
+            print("OK    %s -> %s" % (path, genimg_path))
+        else:
+            print("ERROR %s: %s" % (path, error))
+            nb_errors += 1
+    print("%d rendered, %d failed" % (len(results)-nb_errors, nb_errors))
+    stats = disable_stats()
+    if stats is not None:
+        total = stats.totals()
+        print("times:    %s" % ', '.join("%s %.3f s" % item for item in total['times'].items()))
+        print("counters: %s" % ', '.join("%s %d" % item for item in total['counters'].items()))
+        for path, record in stats.slowest(args.stats):
+            print("%8.3f s  %s" % (record['times'].get('total', 0.0), path))
+    return 1 if nb_errors > 0 else 0
 
 if __name__ == "__main__":
-    pass
-    # sv_prettyplot("/Users/fconti/hwpe-stream/rtl/streamer/hwpe_stream_addressgen.sv", "genimg/hwpe_stream_addressgen", True)
-    # sv_prettyplot("/Users/fconti/hwpe-stream/rtl/fifo/hwpe_stream_fifo.sv", "genimg/hwpe_stream_fifo.pdf", "genimg/hwpe_stream_fifo.dot")
-    # sv_prettyplot("/Users/fconti/hwpe-stream/rtl/fifo/hwpe_stream_fifo_ctrl.sv", "genimg/hwpe_stream_fifo_ctrl.pdf", "genimg/hwpe_stream_fifo_ctrl.dot")
+    sys.exit(main())
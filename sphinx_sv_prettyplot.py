@@ -1,12 +1,18 @@
+# only what the directive class needs is imported here; the cache, the
+# index and the renderers are imported when a build first uses them
 from docutils import nodes
-from docutils.parsers.rst import *
+import docutils.parsers.rst
+import docutils.utils
 import os
+import time
+from collections import OrderedDict
 import svprettyplot.prettyplot as prettyplot
 from docutils.parsers.rst.directives.images import Image
 from sphinx.util.docutils import SphinxDirective
-from sphinx.ext.graphviz import figure_wrapper
-from sphinx.errors import SphinxError
 from docutils.parsers.rst import directives
+from sphinx.util import logging
+
+logger = logging.getLogger(__name__)
 
 class SVPrettyPlot(Image, SphinxDirective):
 
@@ -16,6 +22,7 @@ class SVPrettyPlot(Image, SphinxDirective):
 
     option_spec = Image.option_spec.copy()
     option_spec['caption'] = directives.unchanged
+    option_spec['module'] = directives.unchanged
     has_content = True
 
     def run(self):
@@ -27,14 +34,52 @@ class SVPrettyPlot(Image, SphinxDirective):
 
         document = self.state.document
 
+        module = self.options.get('module')
+        if not os.path.isfile(path) and self.config.svprettyplot_index is not None:
+            # not a file: look the argument up as a module name
+            from svprettyplot.index import ModuleIndex
+            index = ModuleIndex(self.config.svprettyplot_index)
+            found = index.find(path)
+            index.close()
+            if found is None:
+                logger.warning("svprettyplot: no file or indexed module called %s" % path, location=(self.env.docname, self.lineno))
+                return []
+            module = path
+            path = found[0]
+
         basename = os.path.basename(path)
+        if module is not None:
+            basename = '%s_%s' % (basename, module)
         node = nodes.image(uri='%s/%s.*' % (genimg_path, basename), figwidth='95%', width='95%', align='center')
 
+        # re-read this document whenever the SV source changes
+        self.env.note_dependency(os.path.abspath(path))
+
         try:
             os.makedirs(genimg_path)
         except FileExistsError:
             pass
-        comments = prettyplot.sv_prettyplot(path, '%s/%s' % (genimg_path, basename))
+        dependencies = set()
+        try:
+            comments = parse_comments(path, module, self.env.svprettyplot_preprocessor, dependencies)
+        except (OSError, prettyplot.ParseError) as e:
+            logger.warning("svprettyplot: cannot parse %s: %s" % (path, e), location=(self.env.docname, self.lineno))
+            comments = None
+        # ... and whenever a file it includes changes
+        for dependency in sorted(dependencies):
+            self.env.note_dependency(dependency)
+        if comments is None:
+            return []
+
+        # the diagram itself is rendered once per build after all documents
+        # have been read (see render_pending); until then an empty placeholder
+        # lets Sphinx collect the image
+        formats = self.env.svprettyplot_image_formats
+        note_render(self.env, '%s/%s' % (genimg_path, basename), path, module, formats)
+        for fmt in formats:
+            placeholder = '%s/%s.%s' % (genimg_path, basename, fmt)
+            if not os.path.exists(placeholder):
+                open(placeholder, 'w').close()
 
         parser = docutils.parsers.rst.Parser()
 
@@ -55,8 +100,191 @@ class SVPrettyPlot(Image, SphinxDirective):
         else:
             return [node, ]
 
+MIMETYPE_FORMATS = OrderedDict([
+    ( 'image/svg+xml',   'svg' ),
+    ( 'application/pdf', 'pdf' ),
+    ( 'image/png',       'png' ),
+])
+
+def image_formats(app):
+    # render only what the builder can use: its preferred image format
+    if app.config.svprettyplot_formats is not None:
+        return tuple(app.config.svprettyplot_formats)
+    for mimetype in app.builder.supported_image_types:
+        if mimetype in MIMETYPE_FORMATS:
+            return (MIMETYPE_FORMATS[mimetype], )
+    return ('png', )
+
+def init_formats(app):
+    # kept on the environment, which the directive can reach without the
+    # deprecated env.app
+    app.env.svprettyplot_image_formats = image_formats(app)
+
+# (path, mtime, module) -> (comments, {included path: mtime}), shared by the
+# documents read by a process
+PARSED_COMMENTS = {}
+
+def init_preprocessor(app):
+    # a preprocess.Preprocessor built from svprettyplot_preprocess, a dict of
+    # its arguments (include_dirs, defines, packages), or None; kept on the
+    # environment like the image formats
+    if app.config.svprettyplot_preprocess is None:
+        app.env.svprettyplot_preprocessor = None
+    else:
+        from svprettyplot.preprocess import Preprocessor
+        app.env.svprettyplot_preprocessor = Preprocessor(**app.config.svprettyplot_preprocess)
+
+def parse_comments(path, module=None, preprocess=None, dependencies=None):
+    # the paths of the files included by path are added to the set
+    # dependencies
+    dependencies = set() if dependencies is None else dependencies
+    key = (path, os.path.getmtime(path), module)
+    entry = PARSED_COMMENTS.get(key)
+    if entry is None or any(mtime(p) != m for p, m in entry[1].items()):
+        stats = prettyplot.STATS
+        if stats is not None:
+            # same key as sv_prettyplot, so parsing and rendering add up
+            stats.begin(path if module is None else '%s:%s' % (path, module))
+        try:
+            with open(path, "r") as f:
+                code = f.read()
+            files = set()
+            if preprocess is not None:
+                try:
+                    code = preprocess.run(code, path, files)[0]
+                finally:
+                    dependencies.update(files)
+            comments = prettyplot.parse_systemverilog(code, module, path)[1]
+            entry = PARSED_COMMENTS[key] = (comments, dict((p, mtime(p)) for p in files))
+        finally:
+            if stats is not None:
+                stats.end()
+    dependencies.update(entry[1])
+    return entry[0]
+
+def mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+def note_render(env, genimg_path, path, module, formats):
+    # register a render job for the current document; jobs are shared by all
+    # documents plotting the same module, so each diagram is rendered once
+    if not hasattr(env, 'svprettyplot_renders'):
+        env.svprettyplot_renders = {}
+        env.svprettyplot_pending = set()
+    job = env.svprettyplot_renders.setdefault(genimg_path, dict(path=path, module=module, formats=formats, docnames=set()))
+    job['formats'] = tuple(sorted(set(job['formats']) | set(formats)))
+    job['docnames'].add(env.docname)
+    env.svprettyplot_pending.add(genimg_path)
+
+def purge_renders(app, env, docname):
+    if not hasattr(env, 'svprettyplot_renders'):
+        return
+    for genimg_path, job in list(env.svprettyplot_renders.items()):
+        job['docnames'].discard(docname)
+        if len(job['docnames']) == 0:
+            del env.svprettyplot_renders[genimg_path]
+            env.svprettyplot_pending.discard(genimg_path)
+
+def merge_renders(app, env, docnames, other):
+    if not hasattr(other, 'svprettyplot_renders'):
+        return
+    if not hasattr(env, 'svprettyplot_renders'):
+        env.svprettyplot_renders = {}
+        env.svprettyplot_pending = set()
+    for genimg_path, other_job in other.svprettyplot_renders.items():
+        job = env.svprettyplot_renders.setdefault(genimg_path, dict(other_job, docnames=set()))
+        job['formats'] = tuple(sorted(set(job['formats']) | set(other_job['formats'])))
+        job['docnames'] |= other_job['docnames']
+    env.svprettyplot_pending |= other.svprettyplot_pending
+
+def render_pending(app, env):
+    # render all diagrams registered while reading, on a process pool
+    pending = getattr(env, 'svprettyplot_pending', set())
+    if len(pending) == 0:
+        return
+    cache = getattr(app, 'svprettyplot_cache', None)
+    work = []
+    for genimg_path in sorted(pending):
+        job = env.svprettyplot_renders[genimg_path]
+        work.append((job['path'], genimg_path, dict(formats=job['formats'], module=job['module'], cache=cache, backend=app.config.svprettyplot_backend, preprocess=env.svprettyplot_preprocessor)))
+    jobs = app.config.svprettyplot_jobs
+    if jobs is None:
+        # app.parallel is 0 without -j
+        jobs = max(app.parallel, 1)
+    jobs = int(jobs)
+    logger.info("svprettyplot: rendering %d diagrams" % len(work))
+    for path, genimg_path, error in prettyplot.render_many(work, jobs):
+        if error is not None:
+            logger.warning("svprettyplot: cannot render %s: %s" % (path, error))
+    # the images are now newer than the documents using them: mark those as
+    # read after rendering, or the next build would consider them outdated
+    for genimg_path in pending:
+        for docname in env.svprettyplot_renders[genimg_path]['docnames']:
+            if isinstance(env.all_docs.get(docname), int):
+                env.all_docs[docname] = time.time_ns() // 1000
+            elif docname in env.all_docs:
+                env.all_docs[docname] = time.time()
+    env.svprettyplot_pending = set()
+
+def init_cache(app):
+    if app.config.svprettyplot_cache_dir is None:
+        app.svprettyplot_cache = None
+    else:
+        from svprettyplot.cache import RenderCache
+        app.svprettyplot_cache = RenderCache(app.config.svprettyplot_cache_dir, max_size=app.config.svprettyplot_cache_max_size, max_age=app.config.svprettyplot_cache_max_age)
+
+def report_cache(app, exception):
+    if getattr(app, 'svprettyplot_cache', None) is not None:
+        logger.info("svprettyplot cache: %(hits)d hits, %(misses)d misses, %(entries)d entries, %(size)d bytes" % app.svprettyplot_cache.stats())
+
+def init_stats(app):
+    if app.config.svprettyplot_stats > 0:
+        prettyplot.enable_stats()
+
+def report_stats(app, exception):
+    stats = prettyplot.disable_stats()
+    if stats is None or len(stats.files) == 0:
+        return
+    total = stats.totals()
+    logger.info("svprettyplot stats: %d files, %s" % (len(stats.files), ', '.join("%s %.3f s" % item for item in total['times'].items())))
+    logger.info("svprettyplot stats: %s" % ', '.join("%s %d" % item for item in total['counters'].items()))
+    logger.info("svprettyplot stats: slowest modules")
+    for path, record in stats.slowest(app.config.svprettyplot_stats):
+        stages = ', '.join("%s %.3f" % item for item in record['times'].items() if item[0] != 'total')
+        logger.info("  %8.3f s  %s%s" % (record['times'].get('total', 0.0), path, ' (%s)' % stages if stages else ''))
+
+def init_index(app):
+    if app.config.svprettyplot_index is not None and len(app.config.svprettyplot_index_paths) > 0:
+        from svprettyplot.index import ModuleIndex
+        index = ModuleIndex(app.config.svprettyplot_index)
+        logger.info("svprettyplot index: %d files parsed" % index.update(app.config.svprettyplot_index_paths))
+        index.close()
+
 def setup(app):
     app.add_directive("svprettyplot", SVPrettyPlot)
+    app.add_config_value('svprettyplot_formats', None, 'env')
+    app.add_config_value('svprettyplot_cache_dir', None, 'env')
+    app.add_config_value('svprettyplot_cache_max_size', None, 'env')
+    app.add_config_value('svprettyplot_cache_max_age', None, 'env')
+    app.add_config_value('svprettyplot_index', None, 'env')
+    app.add_config_value('svprettyplot_index_paths', [], 'env')
+    app.connect('builder-inited', init_formats)
+    app.connect('builder-inited', init_preprocessor)
+    app.connect('builder-inited', init_cache)
+    app.connect('builder-inited', init_index)
+    app.add_config_value('svprettyplot_jobs', None, '')
+    app.add_config_value('svprettyplot_backend', 'graphviz', 'env')
+    app.add_config_value('svprettyplot_stats', 0, '')
+    app.add_config_value('svprettyplot_preprocess', None, 'env')
+    app.connect('builder-inited', init_stats)
+    app.connect('build-finished', report_stats)
+    app.connect('env-purge-doc', purge_renders)
+    app.connect('env-merge-info', merge_renders)
+    app.connect('env-updated', render_pending)
+    app.connect('build-finished', report_cache)
     return {
         'version': '0.1',
         'parallel_read_safe': True,
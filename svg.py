@@ -0,0 +1,108 @@
+# in-process SVG renderer for the standard module diagram: an inputs column,
+# the module block and an outputs column joined by straight labelled edges,
+# laid out like the Graphviz HTML-label tables without spawning dot
+
+from html import escape
+from svprettyplot.prettyplot import INTERFACE_MAP, DEFAULT_FONT
+
+FONT_SIZE       = 14
+LABEL_FONT_SIZE = 10
+CHAR_WIDTH      = 0.58 # average glyph width, in units of the font size
+TEXT_HEIGHT     = 18
+EDGE_MIN_LENGTH = 54
+MARGIN          = 8
+TEE_SIZE        = 10
+ARROW_SIZE      = 10
+
+def text_width(s, size=FONT_SIZE):
+    return len(s) * size * CHAR_WIDTH
+
+def wire_rows(ports, interfaces):
+    # (kind label, name, edge label, is interface) for each wire on one side
+    rows = []
+    for p in ports:
+        tp = ' ' if p.type in ('logic', 'wire', 'reg') else (p.type or ' ')
+        rows.append((tp, p.name, p.unpacked+''.join(p.packed), False))
+    for p in interfaces:
+        rows.append((INTERFACE_MAP.get(p.interface, p.interface), p.name, p.unpacked, True))
+    return rows
+
+def wire_text(x, y, row, anchor):
+    kind, name, _, _ = row
+    return '<text x="%.1f" y="%.1f" text-anchor="%s"><tspan font-weight="bold">%s</tspan> %s</text>' % (x, y, anchor, escape(kind), escape(name))
+
+def spread(n, top, height):
+    # centers of n rows spread evenly over height
+    return [ top + (i+0.5)*height/n for i in range(n) ]
+
+def module_svg(module, always_coprime=True, cellspacing_block=10, cellspacing_wires=10, font_face=DEFAULT_FONT):
+    inputs  = wire_rows(module.input_ports,  module.incoming_interfaces)
+    outputs = wire_rows(module.output_ports, module.outgoing_interfaces)
+    row_h   = TEXT_HEIGHT + cellspacing_wires
+
+    # column widths
+    in_w  = max([ text_width('%s %s' % r[:2]) for r in inputs  ] + [ 0 ])
+    out_w = max([ text_width('%s %s' % r[:2]) for r in outputs ] + [ 0 ])
+    in_edge  = max([ text_width(r[2], LABEL_FONT_SIZE) for r in inputs  ] + [ 0 ]) + EDGE_MIN_LENGTH
+    out_edge = max([ text_width(r[2], LABEL_FONT_SIZE) for r in outputs ] + [ 0 ]) + EDGE_MIN_LENGTH
+    block_w  = max(text_width(module.name) + 2*cellspacing_block, 4*cellspacing_block)
+
+    # rows: title, then inputs and outputs as in block_label (stacked from
+    # the top with always_coprime, else ports and then interfaces each
+    # spread over their own block of rows), then the interfaces that are
+    # neither incoming nor outgoing
+    n_ports      = max(len(module.input_ports), len(module.output_ports))
+    n_interfaces = max(len(module.incoming_interfaces), len(module.outgoing_interfaces))
+    title_h = TEXT_HEIGHT + 2*cellspacing_block
+    if always_coprime:
+        body_h = max(len(inputs), len(outputs), 1) * row_h
+    else:
+        body_h = max(n_ports + n_interfaces, 1) * row_h
+    rest_h  = len(module.interfaces) * row_h
+    block_h = title_h + body_h + rest_h + cellspacing_block
+
+    x_in    = MARGIN + in_w
+    x_block = x_in + in_edge
+    x_out   = x_block + block_w + out_edge
+    width   = x_out + out_w + MARGIN
+    height  = block_h + 2*MARGIN
+    y_block = MARGIN
+    y_body  = y_block + title_h
+
+    s = []
+    s.append('<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n')
+    s.append('<svg xmlns="http://www.w3.org/2000/svg" width="%dpt" height="%dpt" viewBox="0 0 %.1f %.1f">\n' % (width, height, width, height))
+    s.append('<g font-family="%s" font-size="%d" fill="black" stroke="none">\n' % (escape(font_face), FONT_SIZE))
+    s.append('<rect x="%.1f" y="%.1f" width="%.1f" height="%.1f" fill="none" stroke="black"/>\n' % (x_block, y_block, block_w, block_h))
+    s.append('<text x="%.1f" y="%.1f" text-anchor="middle" font-weight="bold">%s</text>\n' % (x_block + block_w/2, y_block + cellspacing_block + TEXT_HEIGHT*0.75, escape(module.name)))
+
+    for side, rows, nb_side_ports in (('in', inputs, len(module.input_ports)), ('out', outputs, len(module.output_ports))):
+        if always_coprime:
+            ys = [ y_body + (i+0.5)*row_h for i in range(len(rows)) ]
+        else:
+            ys = spread(nb_side_ports, y_body, n_ports*row_h) + spread(len(rows)-nb_side_ports, y_body + n_ports*row_h, n_interfaces*row_h)
+        for row, y in zip(rows, ys):
+            if side == 'in':
+                x0, x1 = x_in + MARGIN/2, x_block
+                s.append(wire_text(x_in, y + FONT_SIZE*0.35, row, 'end') + '\n')
+            else:
+                x0, x1 = x_block + block_w, x_out - MARGIN/2
+                s.append(wire_text(x_out, y + FONT_SIZE*0.35, row, 'start') + '\n')
+            if row[3]:
+                # interface: thick edge with a normal arrowhead at its head
+                s.append('<line x1="%.1f" y1="%.1f" x2="%.1f" y2="%.1f" stroke="black" stroke-width="3"/>\n' % (x0, y, x1 - ARROW_SIZE, y))
+                s.append('<polygon points="%.1f,%.1f %.1f,%.1f %.1f,%.1f" stroke="black" stroke-width="3"/>\n' % (x1 - ARROW_SIZE, y - ARROW_SIZE/3, x1, y, x1 - ARROW_SIZE, y + ARROW_SIZE/3))
+            else:
+                # port: thin edge with a tee on the module side
+                xt = x1 - 2 if side == 'in' else x0 + 2
+                s.append('<line x1="%.1f" y1="%.1f" x2="%.1f" y2="%.1f" stroke="black"/>\n' % (x0, y, x1, y))
+                s.append('<line x1="%.1f" y1="%.1f" x2="%.1f" y2="%.1f" stroke="black"/>\n' % (xt, y - TEE_SIZE/2, xt, y + TEE_SIZE/2))
+            if row[2] != '':
+                s.append('<text x="%.1f" y="%.1f" text-anchor="middle" font-size="%d">%s</text>\n' % ((x0+x1)/2, y - 4, LABEL_FONT_SIZE, escape(row[2])))
+
+    s.append('</g>\n</svg>\n')
+    return ''.join(s)
+
+def render_svg(module, genimg_path, always_coprime=True, cellspacing_block=10, cellspacing_wires=10, font_face=DEFAULT_FONT):
+    with open(genimg_path+".svg", "w") as f:
+        f.write(module_svg(module, always_coprime=always_coprime, cellspacing_block=cellspacing_block, cellspacing_wires=cellspacing_wires, font_face=font_face))
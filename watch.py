@@ -0,0 +1,125 @@
+# watch mode: keeps the parsed modules of an RTL tree in memory, polls the
+# tree and re-renders only the modules whose header changed; an edit limited
+# to comments only rewrites the RST text next to the diagram
+
+import os
+import sys
+import time
+from collections import OrderedDict
+import svprettyplot.prettyplot as prettyplot
+
+class Watcher(object):
+
+    def __init__(self, paths, out_dir, formats=None, **kwargs):
+        # kwargs are passed to prettyplot.render_module
+        self.paths = paths
+        self.out_dir = out_dir
+        self.formats = prettyplot.img_formats(formats)
+        self.kwargs = kwargs
+        # path -> (mtime, size) when last parsed
+        self.stamps = {}
+        # path -> OrderedDict of module name -> (ModuleHeader, comments)
+        self.modules = {}
+
+    def genimg_path(self, path, name):
+        return os.path.join(self.out_dir, '%s_%s' % (os.path.basename(path), name))
+
+    def poll(self):
+        # look at the tree once; returns a list of (event, path, detail) with
+        # event 'render' or 'text' (detail is the module name), 'remove'
+        # (module name) or 'error' (message)
+        events = []
+        seen = set()
+        for path in prettyplot.expand_paths(self.paths):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            seen.add(path)
+            stamp = (st.st_mtime_ns, st.st_size)
+            if self.stamps.get(path) == stamp:
+                continue
+            self.stamps[path] = stamp
+            events += self.update(path)
+        for path in list(self.modules):
+            if path not in seen:
+                del self.stamps[path]
+                events += self.remove(path, self.modules.pop(path))
+        return events
+
+    def update(self, path):
+        try:
+            modules = OrderedDict((m.name, (m, c)) for m, c in prettyplot.iter_modules(path))
+        except Exception as e:
+            # keep the last good state until the file parses again
+            return [ ('error', path, '%s: %s' % (type(e).__name__, e)) ]
+        old = self.modules.get(path, {})
+        self.modules[path] = modules
+        events = []
+        for name, (module, comments) in list(modules.items()):
+            genimg_path = self.genimg_path(path, name)
+            if name not in old or old[name][0] != module:
+                try:
+                    prettyplot.render_module(module, genimg_path, self.formats, **self.kwargs)
+                except Exception as e:
+                    # the last good state is kept (with its outputs), so
+                    # that the next save renders it again
+                    if name in old:
+                        modules[name] = old[name]
+                    else:
+                        del modules[name]
+                    events.append(('error', path, '%s: %s' % (name, e)))
+                    continue
+                events.append(('render', path, name))
+            if name not in old or old[name][1] != comments:
+                with open(genimg_path+".rst", "w") as f:
+                    f.write("\n\n".join(comments[0]))
+                events.append(('text', path, name))
+        events += self.remove(path, OrderedDict((name, m) for name, m in old.items() if name not in modules))
+        return events
+
+    def remove(self, path, modules):
+        # delete the outputs of modules that are gone
+        events = []
+        for name in modules:
+            genimg_path = self.genimg_path(path, name)
+            for suffix in tuple('.'+fmt for fmt in self.formats) + ('.rst', ):
+                try:
+                    os.remove(genimg_path+suffix)
+                except FileNotFoundError:
+                    pass
+            events.append(('remove', path, name))
+        return events
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Watch SystemVerilog files and re-render the modules whose header changes.")
+    parser.add_argument('paths', nargs='+', help=".sv files, directories or globs")
+    parser.add_argument('-o', '--out-dir', default='genimg', help="output directory (default: genimg)")
+    parser.add_argument('-f', '--formats', default='svg', help="comma-separated subset of %s (default: svg)" % ','.join(prettyplot.IMG_FORMATS))
+    parser.add_argument('--backend', choices=prettyplot.BACKENDS, default='native', help="renderer for SVG output (default: native)")
+    parser.add_argument('--no-coprime', action='store_true', help="do not force the coprime row layout")
+    parser.add_argument('--interval', type=float, default=0.1, help="seconds between two looks at the tree (default: 0.1)")
+    args = parser.parse_args(argv)
+
+    formats = tuple(args.formats.split(','))
+    for fmt in formats:
+        if fmt not in prettyplot.IMG_FORMATS:
+            parser.error("unsupported format %r" % fmt)
+    os.makedirs(args.out_dir, exist_ok=True)
+    watcher = Watcher(args.paths, args.out_dir, formats, always_coprime=not args.no_coprime, backend=args.backend)
+    try:
+        while True:
+            t0 = time.perf_counter()
+            events = watcher.poll()
+            if len(events) > 0:
+                for event, path, detail in events:
+                    print("%-6s %s: %s" % (event.upper(), path, detail))
+                print("%d events in %.0f ms" % (len(events), (time.perf_counter()-t0)*1000))
+                sys.stdout.flush()
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        return 0
+
+if __name__ == "__main__":
+    sys.exit(main())